@@ -0,0 +1,203 @@
+import os
+import logging
+from collections import deque
+import numpy as np
+from metrics import metrics
+from exercises import EXERCISES, is_hand_holding_object, evaluate_exercise
+
+##############################################################################
+# HANDS SCHEDULING (duty-cycled hand inference per session)
+##############################################################################
+
+HANDS_EVERY_N_FRAMES = int(os.getenv("HANDS_EVERY_N_FRAMES", 3))  # 1 runs hands on every frame
+HANDS_WRIST_MOTION = float(os.getenv("HANDS_WRIST_MOTION", 0.05))  # Normalized wrist travel that forces a run
+HANDS_REVERIFY_FRAMES = int(os.getenv("HANDS_REVERIFY_FRAMES", 30))  # Grip re-check interval once dumbbells are detected
+HOLDING_VOTE_WINDOW = int(os.getenv("HOLDING_VOTE_WINDOW", 5))  # Hands runs that vote on each hand's grip
+SCHEDULE_WRISTS = [15, 16]  # Pose left/right wrist
+
+
+class HandsSchedule:
+    """
+    Decides which frames of a session run hands inference. While the session
+    is still looking for dumbbells, hands run every HANDS_EVERY_N_FRAMES frames,
+    or sooner when a pose wrist has moved more than HANDS_WRIST_MOTION since
+    the last run. Once dumbbells are detected the grip is only re-verified
+    every HANDS_REVERIFY_FRAMES frames. Frames in between reuse the last hand
+    landmarks and a majority vote over the last HOLDING_VOTE_WINDOW holding
+    results.
+    """
+
+    def __init__(self, every_n_frames=HANDS_EVERY_N_FRAMES, wrist_motion=HANDS_WRIST_MOTION,
+                 reverify_frames=HANDS_REVERIFY_FRAMES, vote_window=HOLDING_VOTE_WINDOW):
+        self.every_n_frames = every_n_frames
+        self.wrist_motion = wrist_motion
+        self.reverify_frames = reverify_frames
+        self.vote_window = vote_window
+        self.reset()
+
+    def reset(self):
+        self.frames_since_run = None  # None until hands have run once
+        self.wrists_at_last_run = None
+        self.last_hands = []
+        self.votes = {"left": deque(maxlen=self.vote_window), "right": deque(maxlen=self.vote_window)}
+
+    def should_run(self, pose_array, verifying=False):
+        if self.frames_since_run is None:
+            return True
+        interval = self.reverify_frames if verifying else self.every_n_frames
+        if self.frames_since_run + 1 >= interval:
+            return True
+        if not verifying and self._wrists_moved(pose_array):
+            metrics.increment("hands_motion_triggers")
+            return True
+        return False
+
+    def _wrists_moved(self, pose_array):
+        if pose_array is None or self.wrists_at_last_run is None:
+            return False
+        return np.abs(pose_array[SCHEDULE_WRISTS, :2] - self.wrists_at_last_run).max() > self.wrist_motion
+
+    def record_run(self, pose_array, hands_results, holding_left, holding_right):
+        self.frames_since_run = 0
+        self.wrists_at_last_run = pose_array[SCHEDULE_WRISTS, :2].copy() if pose_array is not None else None
+        self.last_hands = hands_results
+        self.votes["left"].append(holding_left)
+        self.votes["right"].append(holding_right)
+
+    def record_skip(self):
+        self.frames_since_run += 1
+
+    def holding(self, label):
+        votes = self.votes[label]
+        return sum(votes) * 2 > len(votes)
+
+##############################################################################
+# FRAME ANALYSIS (shared by the live endpoints and offline video analysis)
+##############################################################################
+
+def analyze_frame(job, exercise_state, exercise_type, side="left", hands_schedule=None, timestamp=None):
+    """
+    Runs pose (and if needed hands) inference for one frame through `job` and
+    advances the session's exercise state. Returns the response payload.
+    Without a hands_schedule, hands run on every frame that needs them.
+    `timestamp` is the frame's capture time in seconds (see evaluate_exercise).
+    """
+    pose_array = job.pose()
+    exercise = EXERCISES.get(exercise_type)
+    uses_dumbbells = exercise is None or exercise.uses_dumbbells
+    single_arm = exercise is not None and exercise.single_arm
+
+    # Initialize variables
+    rep_count = exercise_state.rep_count
+    feedback = "Stand upright to start your exercise."
+    # Landmarks stay as arrays here; encode_result() turns them into JSON or binary
+    hand_landmarks = {
+        "left_hand": None,
+        "right_hand": None
+    }
+    holding_left = False
+    holding_right = False
+
+    # Process Pose Landmarks
+    if pose_array is not None:
+        # Count Reps + Feedback using pose landmarks, in one pass over the features
+        rep_count, feedback = evaluate_exercise(pose_array, exercise_type, exercise_state, side, timestamp)
+
+    # Hands run at most once per frame, and with a schedule only on the frames it
+    # picks: the landmark serialization, the holding checks and Bicep Curl side
+    # selection below all share this one result
+    needs_hands = not exercise_state.dumbbells_detected and uses_dumbbells
+    wants_hands = needs_hands or single_arm
+    run_hands = wants_hands and (
+        hands_schedule is None or hands_schedule.should_run(pose_array, verifying=not needs_hands)
+    )
+    hands_skipped = wants_hands and not run_hands
+    if run_hands:
+        hands_results = job.hands()
+    elif hands_skipped:
+        hands_results = hands_schedule.last_hands  # Reuse the last run's landmarks
+        hands_schedule.record_skip()
+        metrics.increment("hands_skipped")
+    else:
+        hands_results = []
+
+    # Process Hands only if dumbbells are not already detected, unless squat
+    if needs_hands:
+        for hand_label, hand_array in hands_results:
+            hand_landmarks[f"{hand_label}_hand"] = hand_array
+
+    if run_hands:
+        if needs_hands:
+            for hand_label, hand_array in hands_results:
+                # Determine if the hand is holding an object
+                holding = is_hand_holding_object(hand_array)
+                if hand_label == "left":
+                    holding_left = holding
+                else:
+                    holding_right = holding
+        if single_arm and hands_results:
+            # Process specific hand landmarks (the last detected hand decides)
+            hand_label, hand_array = hands_results[-1]
+            if hand_label == "left":
+                holding_left = is_hand_holding_object(hand_array)
+            elif hand_label == "right":
+                holding_right = is_hand_holding_object(hand_array)
+        if hands_schedule is not None:
+            hands_schedule.record_run(pose_array, hands_results, holding_left, holding_right)
+
+    if wants_hands and hands_schedule is not None:
+        # Majority of the recent runs, so one missed grip doesn't flip the result
+        holding_left = hands_schedule.holding("left")
+        holding_right = hands_schedule.holding("right")
+
+    # Determine holding_dumbbell based on exercise type
+    if single_arm:
+        side = side.lower()
+        if side == "left":
+            holding_dumbbell = holding_left
+        else:
+            holding_dumbbell = holding_right
+    else:
+        holding_dumbbell = False
+        if holding_dumbbell:
+            exercise_state.dumbbell_detection_counter += 1
+        if exercise_state.dumbbell_detection_counter >= 3:
+            exercise_state.dumbbells_detected = True
+            logging.info(f"Dumbbell consistently detected in {side} hand. Starting rep tracking.")
+        else:
+            exercise_state.dumbbell_detection_counter = 0  # Reset counter if not detected
+
+
+    if uses_dumbbells:
+        if hands_skipped:
+            pass  # The detection counter only moves on frames where hands ran
+        elif holding_dumbbell:
+            exercise_state.dumbbell_detection_counter += 1
+            if exercise_state.dumbbell_detection_counter >= 3:
+                exercise_state.dumbbells_detected = True
+                exercise_state.holding_dumbbells_overall = True
+                logging.info("Both dumbbells consistently detected. Starting exercise tracking.")
+        else:
+            exercise_state.dumbbell_detection_counter = 0  # Reset counter if not detected
+            exercise_state.holding_dumbbells_overall = False
+    else:
+        # For squats, immediately enable tracking
+        if not exercise_state.squat_started:
+            exercise_state.squat_started = True
+            feedback = (
+                f"Stand with feet shoulder-width apart to begin squats. "
+                f"Squat down until your hips are close to your knees and hold for {exercise_state.HOLD_REQUIRED_SECONDS} second(s)."
+            )
+            logging.info("Squat exercise started without dumbbells.")
+        holding_dumbbell = True
+        exercise_state.dumbbells_detected = True
+
+    return {
+        "pose_landmarks": pose_array,
+        "hand_landmarks": hand_landmarks if not exercise_state.dumbbells_detected else None,
+        "rep_count": rep_count,
+        "feedback": feedback,
+        "holding_dumbbell": holding_dumbbell,
+        "holding_dumbbells_overall": exercise_state.holding_dumbbells_overall,
+        "dumbbells_detected": exercise_state.dumbbells_detected
+    }
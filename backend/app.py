@@ -1,14 +1,26 @@
 import os
+import math
 import logging
 import time  # Import time module
-from flask import Flask, request, jsonify
+import threading
+import struct
+import tempfile
+import uuid
+import atexit
+from collections import OrderedDict
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from flask_socketio import SocketIO, emit
 import cv2
 import numpy as np
-import mediapipe as mp
+from inference import get_inference_backend, PrecomputedFrameJob
+from metrics import metrics
+from exercises import ExerciseState, HOLD_REQUIRED_SECONDS
+from analysis import HandsSchedule, analyze_frame
+from video import VIDEO_WORKERS, analyze_video, analyze_video_parallel
+from traces import TRACE_DIR, TraceRecorder
 import google.generativeai as genai
 from dotenv import load_dotenv
-import math
 # Removed load_dotenv since we are not using .env for configurations
 
 # Configure logging
@@ -16,521 +28,625 @@ logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 CORS(app)
+# Threaded handlers let a client keep several frames in flight on one socket
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
 
 ##############################################################################
-# MEDIAPIPE POSE AND HANDS INITIALIZATION
+# FRAME-CHANGE GATING (skip inference on near-identical frames)
 ##############################################################################
 
-mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(
-    static_image_mode=False,
-    model_complexity=0,
-    smooth_landmarks=True,
-    enable_segmentation=False,
-    min_detection_confidence=0.1,
-    min_tracking_confidence=0.1,
-)
-
-mp_hands = mp.solutions.hands
-hands = mp_hands.Hands(
-    static_image_mode=False,
-    max_num_hands=2,
-    model_complexity=0,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
-)
+# Largest gray-level change (0-255) of any thumbnail cell around the last pose
+# below which a frame counts as unchanged (8 is a reasonable start); 0, the
+# default, disables gating
+FRAME_GATE_THRESHOLD = float(os.getenv("FRAME_GATE_THRESHOLD", 0))
+FRAME_GATE_MAX_REUSE = int(os.getenv("FRAME_GATE_MAX_REUSE", 3))  # Infer at least once per this many frames
+FRAME_GATE_SIZE = (32, 24)  # Signature width, height
+FRAME_GATE_MARGIN = 0.1  # Added around the pose's bounding box, as a fraction of the frame
 
-##############################################################################
-# EXERCISE STATE (3-STATE MACHINE)
-##############################################################################
 
+def pose_cells(pose):
+    """Rows and columns of the signature covering the pose's bounding box plus a margin."""
+    width, height = FRAME_GATE_SIZE
+    if pose is None:
+        return slice(None), slice(None)
+    x0, y0 = np.clip(pose[:, :2].min(axis=0) - FRAME_GATE_MARGIN, 0, 1)
+    x1, y1 = np.clip(pose[:, :2].max(axis=0) + FRAME_GATE_MARGIN, 0, 1)
+    rows = slice(int(y0 * height), max(int(np.ceil(y1 * height)), int(y0 * height) + 1))
+    columns = slice(int(x0 * width), max(int(np.ceil(x1 * width)), int(x0 * width) + 1))
+    return rows, columns
+
+
+class FrameGate:
+    """
+    Spots frames that look like the session's last inferred frame (a trainee
+    resting or holding a squat) from a 32x24 grayscale thumbnail, and hands
+    back that frame's landmarks instead of running inference again. A frame
+    is unchanged only if no cell around the last pose changed by the
+    threshold: a moving forearm shifts a few cells a lot and the frame's
+    mean hardly at all. The exercise logic still runs on the reused
+    landmarks, so time-based state like the squat hold keeps advancing.
+    Frames are compared with the last inferred frame rather than the
+    previous one, so slow drift still adds up to a miss.
+    """
 
-class ExerciseState:
-    def __init__(self, hold_required_seconds=1):
-        self.rep_count = 0
-        self.position_state = 0
-        self.previous_position_state = 0
-        self.holding_dumbbells_overall = False
-        self.dumbbells_detected = False
-        self.dumbbell_detection_counter = 0
-        self.squat_started = False  # Flag for squat start
-        self.squat_hold_start_time = None  # Timestamp when squat hold starts
-        self.HOLD_REQUIRED_SECONDS = hold_required_seconds  # Manually set hold duration
+    def __init__(self, threshold=FRAME_GATE_THRESHOLD, max_reuse=FRAME_GATE_MAX_REUSE):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.reset()
 
     def reset(self):
-        self.rep_count = 0
-        self.position_state = 0
-        self.previous_position_state = 0
-        self.holding_dumbbells_overall = False
-        self.dumbbells_detected = False
-        self.dumbbell_detection_counter = 0
-        self.squat_started = False  # Reset squat start flag
-        self.squat_hold_start_time = None  # Reset squat hold timestamp
-
-
-# Initialize the ExerciseState with the configured hold duration
-HOLD_REQUIRED_SECONDS = 1  # Manually set hold duration in seconds
-exercise_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
-
-def reset_exercise_state():
-    exercise_state.reset()
-
-def are_landmarks_too_clustered(landmarks):
-    """
-    Checks if the specified landmarks are too close to each other.
-    This can help in determining if the user is too close to the camera or if the detection is unreliable.
-    """
-    points = [
-        (landmarks[11].x, landmarks[11].y),  # left shoulder
-        (landmarks[12].x, landmarks[12].y),  # right shoulder
-        (landmarks[13].x, landmarks[13].y),  # left elbow
-        (landmarks[14].x, landmarks[14].y),  # right elbow
-        (landmarks[15].x, landmarks[15].y),  # left wrist
-        (landmarks[16].x, landmarks[16].y),  # right wrist
-        (landmarks[23].x, landmarks[23].y),  # left hip
-        (landmarks[24].x, landmarks[24].y),  # right hip
-        (landmarks[25].x, landmarks[25].y),  # left knee
-        (landmarks[26].x, landmarks[26].y)   # right knee
-    ]
-    
-    MIN_DISTANCE = 0.1  # Minimum allowed distance between points
-    
-    # Check distances between all point pairs
-    for i in range(len(points)):
-        for j in range(i + 1, len(points)):
-            dx = points[i][0] - points[j][0]
-            dy = points[i][1] - points[j][1]
-            distance = math.sqrt(dx**2 + dy**2)
-            if distance < MIN_DISTANCE:
-                logging.debug(f"Landmarks {i} and {j} are too close: {distance}")
-                return True
-    return False
+        self.signature = None
+        self.pose = None
+        self.cells = pose_cells(None)
+        self.hands = []
+        self.reused = 0
+
+    def reuse_job(self, frame_rgb):
+        """Returns a job replaying the last landmarks if the frame is unchanged, else None."""
+        if self.threshold <= 0:
+            return None
+        # Bilinear to 4x the signature size, then a 4x4 box average: ~70us at any
+        # resolution, where a direct INTER_AREA resize reads every pixel
+        preview = cv2.resize(frame_rgb, (FRAME_GATE_SIZE[0] * 4, FRAME_GATE_SIZE[1] * 4), interpolation=cv2.INTER_LINEAR)
+        thumbnail = cv2.resize(preview, FRAME_GATE_SIZE, interpolation=cv2.INTER_AREA)
+        signature = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY).astype(np.int16)
+        if (
+            self.signature is not None
+            and self.reused < self.max_reuse
+            and np.abs(signature[self.cells] - self.signature[self.cells]).max() < self.threshold
+        ):
+            self.reused += 1
+            metrics.increment("frame_gate_hits")
+            return PrecomputedFrameJob(self.pose, self.hands)
+        self.signature = signature
+        self.reused = 0
+        metrics.increment("frame_gate_misses")
+        return None
+
+    def remember(self, job):
+        """Keeps the landmarks an inferred frame produced for the next reuse."""
+        pose, hands = job.peek()
+        self.pose = pose
+        self.cells = pose_cells(pose)
+        if hands is not None:
+            self.hands = hands
 
 ##############################################################################
-# 1) LATERAL RAISE (Chest line check only, no angles)
+# LATEST-FRAME MAILBOX (drop stale frames before inference)
 ##############################################################################
 
-def count_lateral_raise_chest(landmarks):
-    """
-    3-state logic for Lateral Raise using only the chest line:
-      - State 0 => arms down (wrists below chest line)
-      - State 1 => arms up (wrists above chest line)
-      - State 2 => returning down
-      A rep is counted after arms fully return down from being up.
-    """
-    if are_landmarks_too_clustered(landmarks):
-        logging.debug("Landmarks are too clustered. Skipping rep count.")
-        return exercise_state.rep_count
-
-    # Shoulders
-    left_shoulder = (landmarks[11].x, landmarks[11].y)
-    right_shoulder = (landmarks[12].x, landmarks[12].y)
-    # Wrists
-    left_wrist = (landmarks[15].x, landmarks[15].y)
-    right_wrist = (landmarks[16].x, landmarks[16].y)
-
-    # Chest line = midpoint of shoulders
-    chest_x = (left_shoulder[0] + right_shoulder[0]) / 2
-    chest_y = (left_shoulder[1] + right_shoulder[1]) / 2
-
-    # Arms up => both wrists above chest line => y < chest_y
-    arms_up = (left_wrist[1] < chest_y) and (right_wrist[1] < chest_y)
-    # Arms down => both wrists below chest line => y > chest_y
-    arms_down = (left_wrist[1] > chest_y) and (right_wrist[1] > chest_y)
-
-    current_state = exercise_state.position_state
-
-    if current_state == 0:
-        # Starting down
-        if arms_up:
-            exercise_state.position_state = 1
-            logging.debug("Transition to State 1: Arms Up")
-    elif current_state == 1:
-        # Arms are up
-        if not arms_up:
-            exercise_state.position_state = 2
-            logging.debug("Transition to State 2: Returning Down")
-    else:  # current_state == 2 => returning
-        if arms_down:
-            exercise_state.rep_count += 1
-            exercise_state.position_state = 0
-            logging.info(f"Lateral Raise Rep Count: {exercise_state.rep_count}")
-
-    return exercise_state.rep_count
-
-def get_lateral_raise_chest_feedback(landmarks):
-    left_shoulder = (landmarks[11].x, landmarks[11].y)
-    right_shoulder = (landmarks[12].x, landmarks[12].y)
-    left_wrist = (landmarks[15].x, landmarks[15].y)
-    right_wrist = (landmarks[16].x, landmarks[16].y)
-
-    chest_x = (left_shoulder[0] + right_shoulder[0]) / 2
-    chest_y = (left_shoulder[1] + right_shoulder[1]) / 2
-
-    arms_up = (left_wrist[1] < chest_y) and (right_wrist[1] < chest_y)
-    arms_down = (left_wrist[1] > chest_y) and (right_wrist[1] > chest_y)
-
-    current_state = exercise_state.position_state
-    feedback = "Lift your wrists above chest level to do a lateral raise."
-
-    if current_state == 0:
-        if arms_up:
-            feedback = "Arms raised! Now lower them back down slowly."
-        else:
-            feedback = "Arms down. Raise both wrists above your chest."
-    elif current_state == 1:
-        if not arms_up:
-            feedback = "Lower your arms slowly to finish the rep."
-        else:
-            feedback = "Hold arms above your chest line, then start lowering."
-    else:  # current_state == 2 => returning
-        if arms_down:
-            feedback = "Rep complete! Arms fully down. Get ready for the next raise."
-        else:
-            feedback = "Keep lowering until your wrists are below your chest line."
 
-    return feedback
-
-##############################################################################
-# 2) SHOULDER PRESS (Angle + Nose crossing)
-##############################################################################
+class FrameMailbox:
+    """
+    Latest-frame-wins bookkeeping for a session's sequence-numbered frames.
+    Every frame is posted on arrival; when its turn comes (under the session
+    lock) it is only analyzed if no newer frame has arrived or been analyzed
+    in the meantime. Frames that queued up behind a slow one are thus
+    dropped instead of making the feedback lag further and further behind.
+    Frames without a sequence number are never dropped.
+    """
 
-def calculate_angle(A, B, C):
-    """
-    Calculates the angle at point B formed by points A, B, and C.
-    """
-    BA = (A[0] - B[0], A[1] - B[1])
-    BC = (C[0] - B[0], C[1] - B[1])
-
-    dot_product = BA[0]*BC[0] + BA[1]*BC[1]
-    magBA = math.sqrt(BA[0]**2 + BA[1]**2)
-    magBC = math.sqrt(BC[0]**2 + BC[1]**2)
-
-    if magBA == 0 or magBC == 0:
-        return 0.0
-
-    cos_angle = dot_product / (magBA * magBC)
-    cos_angle = max(min(cos_angle, 1.0), -1.0)
-    angle = math.degrees(math.acos(cos_angle))
-    return angle
-
-def count_shoulder_press_combined(landmarks):
-    """
-    3-state Shoulder Press:
-      - State 0 => Elbows at ~90° (below nose)
-      - State 1 => Overhead (elbow crosses nose => elbow.y < nose.y)
-      - State 2 => Returning to ~90°
-      A rep is counted when user returns to ~90° from overhead.
-    """
-    if are_landmarks_too_clustered(landmarks):
-        logging.debug("Landmarks are too clustered. Skipping rep count.")
-        return exercise_state.rep_count
-
-    left_shoulder_pt = (landmarks[11].x, landmarks[11].y)
-    left_elbow_pt    = (landmarks[13].x, landmarks[13].y)
-    left_wrist_pt    = (landmarks[15].x, landmarks[15].y)
-    nose_pt          = (landmarks[0].x,  landmarks[0].y)
-
-    elbow_angle = calculate_angle(left_shoulder_pt, left_elbow_pt, left_wrist_pt)
-    elbow_above_nose = (left_elbow_pt[1] < nose_pt[1])
-
-    START_ANGLE_LOW  = 70
-    START_ANGLE_HIGH = 110
-
-    current_state = exercise_state.position_state
-
-    if current_state == 0:
-        # wait for elbow.y < nose.y => overhead => state 1
-        if elbow_above_nose:
-            exercise_state.position_state = 1
-            logging.debug("Transition to State 1: Elbows Overhead")
-    elif current_state == 1:
-        # overhead => if user not elbow_above_nose => state 2
-        if not elbow_above_nose:
-            exercise_state.position_state = 2
-            logging.debug("Transition to State 2: Returning to ~90°")
-    else:  # state 2 => returning
-        # if elbow angle is ~90° and elbow not above nose => rep++
-        if (START_ANGLE_LOW <= elbow_angle <= START_ANGLE_HIGH) and not elbow_above_nose:
-            exercise_state.rep_count += 1
-            exercise_state.position_state = 0
-            logging.info(f"Shoulder Press Rep Count: {exercise_state.rep_count}")
-
-    return exercise_state.rep_count
-
-def get_shoulder_press_feedback_combined(landmarks):
-    left_shoulder_pt = (landmarks[11].x, landmarks[11].y)
-    left_elbow_pt    = (landmarks[13].x, landmarks[13].y)
-    left_wrist_pt    = (landmarks[15].x, landmarks[15].y)
-    nose_pt          = (landmarks[0].x,  landmarks[0].y)
-
-    elbow_angle = calculate_angle(left_shoulder_pt, left_elbow_pt, left_wrist_pt)
-    elbow_above_nose = (left_elbow_pt[1] < nose_pt[1])
-
-    START_ANGLE_LOW  = 70
-    START_ANGLE_HIGH = 110
-    current_state = exercise_state.position_state
-
-    if current_state == 0:
-        if elbow_above_nose:
-            feedback = "Great! Elbows overhead. Now bring them down."
-        else:
-            if elbow_angle < START_ANGLE_LOW:
-                feedback = "Extend elbows more (~90°)."
-            elif elbow_angle > START_ANGLE_HIGH:
-                feedback = "Bend elbows more (~90°)."
-            else:
-                feedback = "Push elbows overhead until they cross your nose."
-    elif current_state == 1:
-        if not elbow_above_nose:
-            feedback = "Lower elbows to ~90° to finish the rep."
-        else:
-            feedback = "Hold overhead, then begin lowering."
-    else:  # state 2 => returning
-        if (START_ANGLE_LOW <= elbow_angle <= START_ANGLE_HIGH) and not elbow_above_nose:
-            feedback = "Rep complete! You're back at the starting position."
-        else:
-            feedback = "Bring elbows back to ~90° to complete the rep."
+    def __init__(self):
+        self.newest_seq = None  # Highest sequence number received
+        self.processed_seq = None  # Highest sequence number analyzed
+        self.dropped = 0
+        self._lock = threading.Lock()  # Posting happens outside the session lock
 
-    return feedback
+    def reset(self):
+        """Forgets the sequence numbers seen, so a client can number from 0 again."""
+        with self._lock:
+            self.newest_seq = None
+            self.processed_seq = None
+            self.dropped = 0
+
+    def post(self, seq):
+        with self._lock:
+            if self.newest_seq is None or seq > self.newest_seq:
+                self.newest_seq = seq
+
+    def claim(self, seq):
+        """Returns True if frame `seq` should be analyzed now, else counts it as dropped."""
+        with self._lock:
+            # newest_seq is None for a frame posted before a reset
+            stale = (
+                (self.newest_seq is not None and seq < self.newest_seq)
+                or (self.processed_seq is not None and seq <= self.processed_seq)
+            )
+            if stale:
+                self.dropped += 1
+                metrics.increment("frames_dropped_stale")
+                return False
+            self.processed_seq = seq
+            return True
+
+
+def parse_frame_seq(value):
+    """Client frame sequence number, or None when the client doesn't send one."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid frame sequence number {value!r}")
 
 ##############################################################################
-# BICEP CURL (One Hand at a Time, Side View)
+# SESSION REGISTRY (one ExerciseState per trainee)
 ##############################################################################
 
-def calculate_bicep_curl_angle(landmarks, side):
-    """Calculates the angle at the elbow for bicep curls (side view)."""
-    if side == "left":
-        shoulder = (landmarks[11].x, landmarks[11].y)
-        elbow = (landmarks[13].x, landmarks[13].y)
-        wrist = (landmarks[15].x, landmarks[15].y)
-    elif side == "right":
-        shoulder = (landmarks[12].x, landmarks[12].y)
-        elbow = (landmarks[14].x, landmarks[14].y)
-        wrist = (landmarks[16].x, landmarks[16].y)
-    else:
-        return 0  # Invalid side
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 600))  # Drop sessions idle this long
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 1000))  # Hard cap, least recently used evicted first
+DEFAULT_SESSION_ID = "default"  # Used by clients that don't send a session id
 
-    return calculate_angle(shoulder, elbow, wrist)  # Assuming you have the calculate_angle function
 
-def count_bicep_curls_side_view(landmarks, side):
-    """Counts bicep curl reps for a single arm (side view)."""
+class TrainingSession:
+    """Everything the server keeps for one trainee between frames."""
 
-    elbow_angle = calculate_bicep_curl_angle(landmarks, side)
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+        self.hands_schedule = HandsSchedule()
+        self.frame_buffers = FrameBuffers()
+        self.frame_gate = FrameGate()
+        self.mailbox = FrameMailbox()
+        self.trace = TraceRecorder(session_id) if TRACE_DIR else None  # Opt-in, see traces.py
+        self.lock = threading.Lock()  # Serializes frames of the same session
+        self.last_seen = time.monotonic()
 
-    FLEXION_ANGLE_THRESHOLD = 45  # Angle at peak flexion
-    EXTENSION_ANGLE_THRESHOLD = 160  # Angle at full extension
 
-    current_state = exercise_state.position_state
+class SessionRegistry:
+    """
+    Creates sessions on demand and evicts them by idle TTL and LRU cap.
+    The OrderedDict is kept in access order, so both the expired and the
+    least recently used sessions are always at the front.
+    """
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_sessions=MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = TrainingSession(session_id)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    evicted_id, evicted = self._sessions.popitem(last=False)
+                    self._close_trace(evicted)
+                    logging.info(f"Session {evicted_id} evicted (LRU cap {self.max_sessions}).")
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_seen = now
+            return session
+
+    def reset(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            with session.lock:
+                session.state.reset()
+                session.hands_schedule.reset()
+                session.frame_gate.reset()
+                session.mailbox.reset()
+                if session.trace is not None:
+                    session.trace.mark_reset()
+
+    def _evict_expired(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._close_trace(session)
+            logging.info(f"Session {session_id} expired after {self.ttl_seconds}s idle.")
+
+    def close_traces(self):
+        """Writes out the buffered trace frames of every session (at shutdown)."""
+        with self._lock:
+            remaining = list(self._sessions.values())
+        for session in remaining:
+            self._close_trace(session)
+
+    @staticmethod
+    def _close_trace(session):
+        if session.trace is not None:
+            with session.lock:
+                session.trace.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+sessions = SessionRegistry()
+atexit.register(sessions.close_traces)
+
+
+def get_session_id():
+    """Reads the client-supplied session id from the form, JSON body or X-Session-ID header."""
+    session_id = request.form.get("session_id") or request.headers.get("X-Session-ID")
+    if not session_id and request.is_json:
+        data = request.get_json(silent=True)
+        session_id = data.get("session_id") if isinstance(data, dict) else None
+    return session_id or DEFAULT_SESSION_ID
+
+##############################################################################
+# FRAME ANALYSIS
+##############################################################################
 
-    if current_state == 0: # Start at full extension
-        if elbow_angle < FLEXION_ANGLE_THRESHOLD:
-            exercise_state.position_state = 1  # Transition to flexion
-    elif current_state == 1: # Flexed
-        if elbow_angle > EXTENSION_ANGLE_THRESHOLD:
-            exercise_state.rep_count += 1
-            exercise_state.position_state = 0 # Back to extension, rep complete
-            logging.info(f"Bicep Curl ({side}) Rep Count: {exercise_state.rep_count}")
+POSE_LANDMARK_COUNT = 33
+HAND_LANDMARK_COUNT = 21
+
+# The pose model looks at a 256x256 input, so decoding large camera frames at
+# full size is mostly wasted work. Frames are decoded at 1/2, 1/4 or 1/8 scale
+# (libjpeg scales during the DCT, so JPEG decoding gets cheaper as well) as long
+# as their short side stays at least DECODE_MIN_SIDE pixels. 0 disables this.
+DECODE_MIN_SIDE = int(os.getenv("DECODE_MIN_SIDE", 480))
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG start-of-frame markers (all except DHT, JPG and DAC carry the frame size)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def encoded_image_size(data):
+    """Reads (width, height) from a PNG or JPEG header without decoding, or returns None."""
+    if data[:8] == PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:  # Markers without a length
+            offset += 2
+        else:
+            offset += 2 + struct.unpack(">H", data[offset + 2:offset + 4])[0]
+    return None
 
-def get_bicep_curls_feedback_side_view(landmarks, side):
-    elbow_angle = calculate_bicep_curl_angle(landmarks, side)
 
-    FLEXION_ANGLE_THRESHOLD = 45
-    EXTENSION_ANGLE_THRESHOLD = 160
+def decode_flag_for(size, min_side=DECODE_MIN_SIDE):
+    """Picks the cheapest imdecode flag that keeps the short side >= min_side."""
+    if size is None or min_side <= 0:
+        return cv2.IMREAD_COLOR
+    short_side = min(size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if short_side // factor >= min_side:
+            return flag
+    return cv2.IMREAD_COLOR
 
-    current_state = exercise_state.position_state
 
-    if current_state == 0:
-        if elbow_angle < FLEXION_ANGLE_THRESHOLD:
-            feedback = "Great curl! Now extend your arm fully."
-        elif elbow_angle < EXTENSION_ANGLE_THRESHOLD: # Added check for incomplete extension
-            feedback = "Extend your arm further to start the rep."            
-        else:
-             feedback = f"Curl your {side} arm towards your shoulder."
+class FrameBuffers:
+    """
+    A session's RGB output buffer for color conversion, reallocated only when
+    the resolution changes. Frames are decoded under the session lock and
+    inference is done with a frame (it reads it synchronously, or the process
+    backend copies it into shared memory) before the next one is decoded, so
+    one buffer serves every frame of the session.
+    """
 
-    elif current_state == 1:
-        if elbow_angle > EXTENSION_ANGLE_THRESHOLD:
-            feedback = "Rep complete! Start your next curl."
-        else:
-            feedback = "Extend your arm completely to complete the rep."
+    def __init__(self):
+        self.rgb = None
 
-    return feedback
+    def rgb_for(self, height, width):
+        if self.rgb is None or self.rgb.shape != (height, width, 3):
+            self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+            metrics.increment("frame_buffer_allocations")
+        return self.rgb
 
-##############################################################################
-# 3) SQUATS (Pose Landmarks Only, No Angles, 
-#    Rep counted once user returns fully to original standing position with a 1-second hold)
-##############################################################################
 
-def count_squats_pose_only(landmarks):
-    """
-    3-state logic for Squats with a 1-second hold at the bottom:
-      - State 0 => Standing (hip significantly above knee)
-      - State 1 => Squat position (hip near knee level) with hold
-      - State 2 => Returning to standing
-      A rep is counted after holding the squat position for HOLD_REQUIRED_SECONDS and returning to standing.
-    """
-    MIN_DISTANCE = 0.2  # Use same distance for proximity
-
-    left_hip_pt = (landmarks[23].x, landmarks[23].y)
-    left_knee_pt = (landmarks[25].x, landmarks[25].y)
-
-    # Calculate the absolute vertical distance between hip and knee
-    distance = abs(left_hip_pt[1] - left_knee_pt[1])
-
-    # Define squat state based on proximity of hips to knees
-    hip_near_knee = distance <= MIN_DISTANCE  # Check if hips are close to knee
-    hip_above_knee = left_hip_pt[1] < left_knee_pt[1] - MIN_DISTANCE  # Hips are significantly above knees
-
-    current_state = exercise_state.position_state
-    previous_state = exercise_state.previous_position_state  # Get previous state
-
-    current_time = time.time()
-
-    if current_state == 0:  # Standing
-        if hip_near_knee and previous_state != 1:
-            exercise_state.position_state = 1
-            exercise_state.squat_hold_start_time = current_time  # Start hold timer
-            logging.debug("Transition to State 1: Squat Position (Hips Near Knees)")
-    elif current_state == 1:  # Squat position
-        if hip_near_knee:
-            if exercise_state.squat_hold_start_time is None:
-                exercise_state.squat_hold_start_time = current_time  # Initialize hold start time
-                logging.debug("Squat hold timer started.")
-            hold_duration = current_time - exercise_state.squat_hold_start_time
-            logging.debug(f"Squat hold duration: {hold_duration:.2f} seconds")
-            if hold_duration >= exercise_state.HOLD_REQUIRED_SECONDS:
-                # Hold achieved, ready to return
-                exercise_state.position_state = 2
-                logging.debug("Hold achieved. Transition to State 2: Returning to Standing")
-        else:
-            # User did not hold the squat position long enough
-            exercise_state.position_state = 0
-            exercise_state.squat_hold_start_time = None
-            logging.debug("Hold not achieved. Reset to State 0: Standing")
-    elif current_state == 2:  # Returning to standing
-        if hip_above_knee:
-            exercise_state.rep_count += 1
-            exercise_state.position_state = 0
-            exercise_state.squat_hold_start_time = None
-            logging.info(f"Squat Rep Count: {exercise_state.rep_count}")
+def decode_frame(file, buffers=None):
+    """
+    Decodes an encoded (JPEG/PNG) frame into an RGB array, reduced in size if
+    it is large. With `buffers`, the RGB array is the session's reused buffer.
+    """
+    if not file:  # imdecode asserts on an empty buffer instead of returning None
+        raise ValueError("Empty frame")
+    np_frame = np.frombuffer(file, np.uint8)
+    flag = decode_flag_for(encoded_image_size(file))
+    frame = cv2.imdecode(np_frame, flag)  # No dst here: the Python binding always allocates
+    if frame is None:
+        raise ValueError("Could not decode frame")
+    if flag != cv2.IMREAD_COLOR:
+        metrics.increment("frames_decoded_reduced")
+    rgb = buffers.rgb_for(*frame.shape[:2]) if buffers is not None else None
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+
+# Raw uploads skip JPEG encoding on the client and decoding here. The bytes are
+# width x height pixels in the layout named by X-Frame-Format (or "format" on
+# the socket), rows top to bottom with no padding.
+RAW_FRAME_CHANNELS = {"rgb": 3, "rgba": 4}
+RAW_YUV420_CONVERSIONS = {  # Full Y plane followed by quarter-size chroma
+    "yuv420": cv2.COLOR_YUV2RGB_I420,
+    "i420": cv2.COLOR_YUV2RGB_I420,
+    "nv12": cv2.COLOR_YUV2RGB_NV12,
+    "nv21": cv2.COLOR_YUV2RGB_NV21,
+}
+
+
+def decode_raw_frame(data, pixel_format, width, height, buffers=None):
+    """
+    Wraps raw uploaded pixels as an RGB array. RGB bytes are used in place
+    (np.frombuffer + reshape, no copy, read-only); RGBA and YUV 4:2:0 frames
+    need one color conversion, which replaces the JPEG decode and writes into
+    the session's buffer when `buffers` is given.
+    """
+    pixel_format = pixel_format.lower()
+    width, height = int(width), int(height)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid raw frame size {width}x{height}")
+    if pixel_format in RAW_FRAME_CHANNELS:
+        shape = (height, width, RAW_FRAME_CHANNELS[pixel_format])
+    elif pixel_format in RAW_YUV420_CONVERSIONS:
+        if width % 2 or height % 2:
+            raise ValueError("YUV 4:2:0 frames need an even width and height")
+        shape = (height * 3 // 2, width)
+    else:
+        raise ValueError(f"Unsupported raw frame format {pixel_format!r}")
 
-    exercise_state.previous_position_state = current_state  # Save the current state for next loop
+    pixels = np.frombuffer(data, np.uint8)
+    if pixels.size != np.prod(shape):
+        raise ValueError(f"Expected {np.prod(shape)} bytes for a {width}x{height} {pixel_format} frame, got {pixels.size}")
+    frame = pixels.reshape(shape)
+    if pixel_format == "rgb":
+        return frame
+    rgb = buffers.rgb_for(height, width) if buffers is not None else None
+    if pixel_format == "rgba":
+        return cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB, dst=rgb)
+    return cv2.cvtColor(frame, RAW_YUV420_CONVERSIONS[pixel_format], dst=rgb)
 
-    return exercise_state.rep_count
 
-def get_squats_pose_feedback(landmarks):
+def read_request_frame(buffers=None):
     """
-    Provides feedback based on squat states, using the MIN_DISTANCE for the squat depth
-    and instructs the user to hold the squat position for HOLD_REQUIRED_SECONDS.
+    Returns the RGB frame of a /process_frame request: an encoded image in the
+    "frame" file, or raw pixels (X-Frame-Format, X-Frame-Width and
+    X-Frame-Height headers) in the "frame" file or the request body.
     """
-    MIN_DISTANCE = 0.2
-    left_hip_pt = (landmarks[23].x, landmarks[23].y)
-    left_knee_pt = (landmarks[25].x, landmarks[25].y)
+    pixel_format = request.headers.get("X-Frame-Format")
+    if pixel_format is None:
+        return decode_frame(request.files["frame"].read(), buffers)
+    data = request.files["frame"].read() if "frame" in request.files else request.get_data()
+    return decode_raw_frame(
+        data, pixel_format, request.headers.get("X-Frame-Width", 0), request.headers.get("X-Frame-Height", 0), buffers
+    )
 
-    distance = abs(left_hip_pt[1] - left_knee_pt[1])
 
-    hip_near_knee = distance <= MIN_DISTANCE
-    hip_above_knee = left_hip_pt[1] < left_knee_pt[1] - MIN_DISTANCE
+def analyze_session_job(session, job, exercise_type, side="left", timestamp=None, hands_schedule=None):
+    """
+    Runs analyze_frame on a frame job with the session's exercise state and
+    records the frame in the session's trace, if it has one. The caller holds
+    session.lock.
+    """
+    if session.trace is not None and timestamp is None:
+        timestamp = time.time()  # The clock evaluate_exercise would use, recorded for replay
+    result = analyze_frame(job, session.state, exercise_type, side, hands_schedule, timestamp)
+    if session.trace is not None:
+        session.trace.record(result, exercise_type, side, timestamp)
+    return result
 
-    current_state = exercise_state.position_state
 
-    feedback = f"Squat down until your hips are close to your knees and hold for {exercise_state.HOLD_REQUIRED_SECONDS} second(s)."
+def analyze_session_frame(session, frame_rgb, exercise_type, side="left", timestamp=None):
+    """
+    Analyzes a decoded frame for a session, reusing the last landmarks when the
+    frame gate finds it unchanged. The caller holds session.lock.
+    """
+    job = session.frame_gate.reuse_job(frame_rgb)
+    if job is not None:
+        return analyze_session_job(session, job, exercise_type, side, timestamp, session.hands_schedule)
+    with get_inference_backend().frame(session.session_id, frame_rgb) as job:
+        result = analyze_session_job(session, job, exercise_type, side, timestamp, session.hands_schedule)
+        session.frame_gate.remember(job)
+    return result
+
+def parse_capture_timestamp(value):
+    """
+    Client capture time of a frame, sent in milliseconds (e.g. Date.now()),
+    as seconds; None when the client doesn't send one. A client should send
+    it with every frame or with none, since server time is a different clock.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        milliseconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid capture timestamp {value!r}")
+    if not math.isfinite(milliseconds):  # float() accepts "nan" and "Infinity"
+        raise ValueError(f"Invalid capture timestamp {value!r}")
+    return milliseconds / 1000.0
 
-    if current_state == 0:  # Standing
-        if hip_near_knee:
-            feedback = f"Great squat! Hold this position for {exercise_state.HOLD_REQUIRED_SECONDS} second(s) to complete the rep."
-        else:
-            feedback = f"Squat down until your hips are close to your knees and hold for {exercise_state.HOLD_REQUIRED_SECONDS} second(s)."
-    elif current_state == 1:  # Squat position
-        if exercise_state.squat_hold_start_time:
-            hold_duration = time.time() - exercise_state.squat_hold_start_time
-            if hold_duration < exercise_state.HOLD_REQUIRED_SECONDS:
-                remaining_time = exercise_state.HOLD_REQUIRED_SECONDS - hold_duration
-                feedback = f"Hold the squat position for {remaining_time:.1f} more second(s)."
-            else:
-                feedback = "Hold achieved! Now return to standing to complete the rep."
-        else:
-            feedback = f"Hold the squat position for {exercise_state.HOLD_REQUIRED_SECONDS} second(s)."
-    else:  # State 2 => returning
-        if hip_above_knee:
-            feedback = "Rep complete! You're back at the starting position."
-        else:
-            feedback = "Keep rising until you are fully standing to complete the rep."
 
-    return feedback
+def read_json_object():
+    """The request's JSON body, which must be an object."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return data
 
-##############################################################################
-# HAND HOLDING DETECTION
-##############################################################################
 
-def is_hand_holding_object(hand_landmarks):
-    """
-    Determines if a hand is holding an object based on finger landmarks.
-    Returns True if the majority of fingers are curled and the spread of fingertips is small.
-    """
-    # Define finger tip and pip landmarks indices
-    FINGER_TIPS = [4, 8, 12, 16, 20]
-    FINGER_PIPS = [3, 6, 10, 14, 18]
-    
-    # Criterion 1: Majority of fingers are curled
-    curled_fingers = 0
-    for tip, pip in zip(FINGER_TIPS, FINGER_PIPS):
-        # In MediaPipe, higher y-value means lower in the image (assuming origin at top-left)
-        if hand_landmarks[tip].y > hand_landmarks[pip].y:
-            curled_fingers += 1
-    
-    # Update: Require at least 4 curled fingers instead of 3
-    REQUIRED_CURLED_FINGERS = 4
-    
-    # Criterion 2: Spread of fingertips is small
-    # Calculate average distance between all pairs of fingertips
-    tips = [hand_landmarks[tip] for tip in FINGER_TIPS]
-    distances = []
-    for i in range(len(tips)):
-        for j in range(i + 1, len(tips)):
-            dx = tips[i].x - tips[j].x
-            dy = tips[i].y - tips[j].y
-            distance = math.sqrt(dx**2 + dy**2)
-            distances.append(distance)
-    
-    if distances:
-        avg_distance = sum(distances) / len(distances)
-    else:
-        avg_distance = 0
-    
-    # Update: Lower the spread threshold for stricter detection
-    SPREAD_THRESHOLD = 0.15  # Previously 0.2
-    
-    small_spread = avg_distance < SPREAD_THRESHOLD
-    
-    # Logging for debugging
-    logging.debug(f"Curled fingers: {curled_fingers}, Average fingertip distance: {avg_distance:.3f}, Small spread: {small_spread}")
-    
-    # Determine holding status based on updated criteria
-    if curled_fingers >= REQUIRED_CURLED_FINGERS and small_spread:
-        return True
-    else:
-        return False
+def parse_uploaded_landmarks(points, count, name):
+    """
+    Turns uploaded (count, 2|3|4) points into a (count, 4) float32 landmark array.
+    Missing z defaults to 0 and missing visibility to 1.
+    """
+    try:
+        points = np.asarray(points, dtype=np.float32)
+    except TypeError:
+        raise ValueError(f"{name} must be {count} points of 2 to 4 numbers")
+    if points.ndim != 2 or points.shape[0] != count or points.shape[1] not in (2, 3, 4):
+        raise ValueError(f"{name} must be {count} points of 2 to 4 values, got shape {points.shape}")
+    array = np.zeros((count, 4), dtype=np.float32)
+    array[:, 3] = 1.0
+    array[:, :points.shape[1]] = points
+    return array
+
+
+def read_uploaded_landmarks():
+    """
+    Reads client-side landmarks from either a JSON body
+        {"pose": 33 x [x, y(, z, visibility)], "left_hand": 21 x [x, y], "right_hand": ...}
+    or a raw float32 body of 33 x 4 pose values followed by 21 x 2 values for
+    each hand named in the X-Hands header (e.g. "left,right").
+    Returns the pose array and a list of (label, hand array).
+    """
+    if request.is_json:
+        data = read_json_object()
+        pose_array = parse_uploaded_landmarks(data.get("pose"), POSE_LANDMARK_COUNT, "pose")
+        hands = [
+            (label, parse_uploaded_landmarks(data[f"{label}_hand"], HAND_LANDMARK_COUNT, f"{label}_hand"))
+            for label in ("left", "right") if data.get(f"{label}_hand")
+        ]
+        return pose_array, hands
+
+    values = np.frombuffer(request.get_data(), dtype="<f4")
+    labels = [label.strip().lower() for label in request.headers.get("X-Hands", "").split(",") if label.strip()]
+    expected = POSE_LANDMARK_COUNT * 4 + len(labels) * HAND_LANDMARK_COUNT * 2
+    if values.size != expected or any(label not in ("left", "right") for label in labels):
+        raise ValueError(f"Expected {expected} float32 values for pose + hands {labels}, got {values.size}")
+    pose_array = values[:POSE_LANDMARK_COUNT * 4].reshape(POSE_LANDMARK_COUNT, 4)
+    hands = []
+    offset = POSE_LANDMARK_COUNT * 4
+    for label in labels:
+        points = values[offset:offset + HAND_LANDMARK_COUNT * 2].reshape(HAND_LANDMARK_COUNT, 2)
+        hands.append((label, parse_uploaded_landmarks(points, HAND_LANDMARK_COUNT, f"{label}_hand")))
+        offset += HAND_LANDMARK_COUNT * 2
+    return pose_array, hands
 
 ##############################################################################
-# MAIN FEEDBACK ROUTER
+# RESPONSE ENCODING (JSON or packed binary landmarks)
 ##############################################################################
 
-def get_exercise_feedback(landmarks, exercise_type, side=None): # Add side parameter
-    if exercise_type == "Lateral Raise":
-        return get_lateral_raise_chest_feedback(landmarks)
-    elif exercise_type == "Shoulder Press":
-        return get_shoulder_press_feedback_combined(landmarks)
-    elif exercise_type == "Squats":
-        return get_squats_pose_feedback(landmarks)
-    elif exercise_type == "Bicep Curl":
-        if side is None:  # Default to left if no side is specified
-            side = "left"  
-        count_bicep_curls_side_view(landmarks, side) # Count for specific side
-        return get_bicep_curls_feedback_side_view(landmarks, side)
+# Pose landmarks below this id (face) are never sent to clients
+FIRST_RESPONSE_POSE_ID = 11
+
+# Opt-in binary responses, negotiated through the Accept header
+LANDMARKS_F32_MIMETYPE = "application/vnd.gymfluencer.landmarks.f32"
+LANDMARKS_I16_MIMETYPE = "application/vnd.gymfluencer.landmarks.i16"
+
+# Binary layout (little-endian):
+#   header  <4sBBBBBBHIH  magic "GFLM", version, encoding (0=f32, 1=i16),
+#                         flags, first pose id, pose count, hand mask
+#                         (1=left, 2=right), i16 scale, rep_count, feedback bytes
+#   feedback UTF-8, zero padded so the arrays start at a multiple of 4 bytes
+#   pose    (pose count, 4) rows of x, y, z, visibility; ids are implicit
+#   hands   left then right (21, 4) each, only those set in the hand mask
+# int16 values are value * scale, so +-4.0 survives quantization.
+LANDMARKS_MAGIC = b"GFLM"
+LANDMARKS_VERSION = 1
+LANDMARKS_HEADER = struct.Struct("<4sBBBBBBHIH")
+LANDMARKS_I16_SCALE = 8192
+FLAG_HOLDING_DUMBBELL = 1
+FLAG_HOLDING_DUMBBELLS_OVERALL = 2
+FLAG_DUMBBELLS_DETECTED = 4
+FLAG_HAND_LANDMARKS = 8  # Hands were part of this response (JSON hand_landmarks not null)
+
+
+def landmarks_to_json(array, first_id=0):
+    if array is None:
+        return []
+    return [
+        {"id": idx, "x": x, "y": y, "z": z, "visibility": visibility}
+        for idx, (x, y, z, visibility) in enumerate(array[first_id:].tolist(), start=first_id)
+    ]
+
 
+def result_to_json(result):
+    payload = dict(result)
+    payload["pose_landmarks"] = landmarks_to_json(result["pose_landmarks"], FIRST_RESPONSE_POSE_ID)
+    if result["hand_landmarks"] is not None:
+        payload["hand_landmarks"] = {
+            key: landmarks_to_json(array) for key, array in result["hand_landmarks"].items()
+        }
+    return payload
+
+
+def result_to_binary(result, quantize=False):
+    pose_array = result["pose_landmarks"]
+    pose = pose_array[FIRST_RESPONSE_POSE_ID:] if pose_array is not None else np.empty((0, 4), np.float32)
+    blocks = [pose]
+    hand_mask = 0
+    flags = 0
+    if result["hand_landmarks"] is not None:
+        flags |= FLAG_HAND_LANDMARKS
+        for bit, key in ((1, "left_hand"), (2, "right_hand")):
+            if result["hand_landmarks"][key] is not None:
+                hand_mask |= bit
+                blocks.append(result["hand_landmarks"][key])
+    if result["holding_dumbbell"]:
+        flags |= FLAG_HOLDING_DUMBBELL
+    if result["holding_dumbbells_overall"]:
+        flags |= FLAG_HOLDING_DUMBBELLS_OVERALL
+    if result["dumbbells_detected"]:
+        flags |= FLAG_DUMBBELLS_DETECTED
+
+    values = np.concatenate(blocks).astype(np.float32, copy=False)
+    if quantize:
+        values = np.clip(np.rint(values * LANDMARKS_I16_SCALE), -32768, 32767).astype("<i2")
     else:
-        return "Move to start position or select a valid exercise."
+        values = values.astype("<f4", copy=False)
+
+    feedback = result["feedback"].encode("utf-8")
+    padding = b"\0" * (-(LANDMARKS_HEADER.size + len(feedback)) % 4)  # 4-byte aligned arrays for typed-array views
+    header = LANDMARKS_HEADER.pack(
+        LANDMARKS_MAGIC, LANDMARKS_VERSION, 1 if quantize else 0, flags,
+        FIRST_RESPONSE_POSE_ID, len(pose), hand_mask, LANDMARKS_I16_SCALE,
+        result["rep_count"], len(feedback),
+    )
+    return header + feedback + padding + values.tobytes()
+
+
+def encode_result(result):
+    """Builds the HTTP response for an analyze_frame() result, honoring the Accept header."""
+    best = request.accept_mimetypes.best_match(
+        ["application/json", LANDMARKS_F32_MIMETYPE, LANDMARKS_I16_MIMETYPE],
+        default="application/json",
+    )
+    if best == LANDMARKS_F32_MIMETYPE:
+        return Response(result_to_binary(result), mimetype=LANDMARKS_F32_MIMETYPE), 200
+    if best == LANDMARKS_I16_MIMETYPE:
+        return Response(result_to_binary(result, quantize=True), mimetype=LANDMARKS_I16_MIMETYPE), 200
+    return jsonify(result_to_json(result)), 200
+
+
+def encode_dropped(seq, mailbox):
+    """
+    Builds the HTTP response for a frame dropped by the mailbox: the drop info
+    in X- headers, plus a JSON body for clients that asked for JSON. Binary
+    clients get 204 No Content, since there is no result to decode.
+    """
+    headers = {
+        "X-Frame-Dropped": "1",
+        "X-Frame-Seq": str(seq),
+        "X-Latest-Seq": str(mailbox.newest_seq),
+        "X-Dropped-Frames": str(mailbox.dropped),
+    }
+    best = request.accept_mimetypes.best_match(
+        ["application/json", LANDMARKS_F32_MIMETYPE, LANDMARKS_I16_MIMETYPE],
+        default="application/json",
+    )
+    if best != "application/json":
+        return Response(headers=headers), 204
+    response = jsonify({
+        "dropped": True,
+        "seq": seq,
+        "latest_seq": mailbox.newest_seq,
+        "dropped_frames": mailbox.dropped,
+    })
+    response.headers.update(headers)
+    return response, 200
 
 ##############################################################################
 # FLASK ROUTES
@@ -541,8 +657,13 @@ def home():
     return jsonify({
         "message": "Welcome to the Gymfluencer API!",
         "endpoints": {
-            "/process_frame": "POST - Process exercise frames",
+            "/process_frame": "POST - Process exercise frames (JPEG/PNG, or raw RGB/RGBA/YUV420 pixels)",
+            "/process_frames": "POST - Process an ordered batch of frames in one request",
+            "/process_landmarks": "POST - Count reps from client-side pose landmarks",
+            "/analyze_video": "POST - Count reps in a recorded workout video",
+            "/socket.io (event: frame)": "WebSocket - Stream frames and receive results as they're ready",
             "/reset_exercise": "POST - Reset exercise state",
+            "/metrics": "GET - Inference and frame-processing counters",
             "/generate_plan": "POST - Generate a personalized diet plan",
             "/workout_plan": "POST - Generate a personalized workout plan"
         }
@@ -550,161 +671,244 @@ def home():
 
 @app.route("/process_frame", methods=["POST"])
 def process_frame():
-    if "frame" not in request.files:
+    if "frame" not in request.files and "X-Frame-Format" not in request.headers:
         return jsonify({"error": "No frame provided"}), 400
 
     try:
+        exercise_type = request.form.get("exercise_type") or request.headers.get("X-Exercise-Type", "Lateral Raise")
+        side = request.form.get("side") or request.headers.get("X-Side", "left")  # Only used for Bicep Curl
+        seq = parse_frame_seq(request.form.get("seq") or request.headers.get("X-Frame-Seq"))
+        timestamp = parse_capture_timestamp(request.form.get("timestamp") or request.headers.get("X-Frame-Timestamp"))
+        session = sessions.get(get_session_id())
+        if seq is not None:
+            session.mailbox.post(seq)
+
+        # One frame at a time per session so reps are never double counted
+        # (and the session's frame buffer is never overwritten while in use)
+        with session.lock:
+            if seq is not None and not session.mailbox.claim(seq):
+                # A newer frame is already waiting or done; skip decode and inference
+                return encode_dropped(seq, session.mailbox)
+            frame_rgb = read_request_frame(session.frame_buffers)
+            result = analyze_session_frame(session, frame_rgb, exercise_type, side, timestamp)
+        if seq is None:
+            return encode_result(result)
+        result["seq"] = seq
+        result["dropped_frames"] = session.mailbox.dropped
+        response, status = encode_result(result)
+        response.headers["X-Dropped-Frames"] = str(session.mailbox.dropped)  # Binary bodies have no field for it
+        return response, status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error processing frame: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+MAX_BATCH_FRAMES = int(os.getenv("MAX_BATCH_FRAMES", 30))
+
+
+@app.route("/process_frames", methods=["POST"])
+def process_frames():
+    """
+    Batch version of /process_frame for high-latency clients: a multipart
+    request with several "frame" files (in capture order) and optionally one
+    "timestamp" field per frame. The frames go through inference and the
+    exercise state machine one after another under a single session lock.
+    Returns the result of the last frame, plus every frame's result (without
+    landmarks, to keep the response small) in "results" when results=all.
+    """
+    files = request.files.getlist("frame")
+    if not files:
+        return jsonify({"error": "No frames provided"}), 400
+
+    try:
+        if len(files) > MAX_BATCH_FRAMES:
+            raise ValueError(f"At most {MAX_BATCH_FRAMES} frames per batch, got {len(files)}")
+        timestamps = [parse_capture_timestamp(value) for value in request.form.getlist("timestamp")]
+        if timestamps and len(timestamps) != len(files):
+            raise ValueError(f"Got {len(timestamps)} timestamps for {len(files)} frames")
         exercise_type = request.form.get("exercise_type", "Lateral Raise")
-        file = request.files["frame"].read()
-
-        # Decode image
-        np_frame = np.frombuffer(file, np.uint8)
-        frame = cv2.imdecode(np_frame, cv2.IMREAD_COLOR)
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        # Process Pose
-        pose_results = pose.process(frame_rgb)
-
-        # Initialize variables
-        landmarks = []
-        rep_count = exercise_state.rep_count
-        feedback = "Stand upright to start your exercise."
-        hand_landmarks = {
-            "left_hand": [],
-            "right_hand": []
-        }
-        holding_left = False
-        holding_right = False
-
-        # Process Pose Landmarks
-        if pose_results.pose_landmarks:
-            raw_landmarks = pose_results.pose_landmarks.landmark
-
-            # Add Pose Landmarks to response
-            landmarks = [
-                {
-                    "id": idx,
-                    "x": lm.x,
-                    "y": lm.y,
-                    "z": lm.z,
-                    "visibility": lm.visibility
-                }
-                for idx, lm in enumerate(raw_landmarks) if idx >= 11
+        side = request.form.get("side", "left")  # Only used for Bicep Curl
+        per_frame = request.form.get("results", "final") == "all"
+        session = sessions.get(get_session_id())
+
+        results = []
+        with session.lock:
+            for index, file in enumerate(files):
+                frame_rgb = decode_frame(file.read(), session.frame_buffers)
+                timestamp = timestamps[index] if timestamps else None
+                results.append(analyze_session_frame(session, frame_rgb, exercise_type, side, timestamp))
+        metrics.increment("batch_requests")
+        metrics.increment("batch_frames", len(results))
+
+        payload = result_to_json(results[-1])
+        payload["frames"] = len(results)
+        if per_frame:
+            payload["results"] = [
+                {key: value for key, value in result.items() if key not in ("pose_landmarks", "hand_landmarks")}
+                for result in results
             ]
+        return jsonify(payload), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error processing frame batch: {e}")
+        return jsonify({"error": str(e)}), 500
 
-            # Count Reps + Feedback using pose landmarks
-            if exercise_type == "Lateral Raise":
-                rep_count = count_lateral_raise_chest(raw_landmarks)
-                feedback = get_lateral_raise_chest_feedback(raw_landmarks)
-
-            elif exercise_type == "Shoulder Press":
-                rep_count = count_shoulder_press_combined(raw_landmarks)
-                feedback = get_shoulder_press_feedback_combined(raw_landmarks)
-
-            elif exercise_type == "Squats":
-                rep_count = count_squats_pose_only(raw_landmarks)
-                feedback = get_squats_pose_feedback(raw_landmarks)
-            elif exercise_type == "Bicep Curl":
-                side = request.form.get("side", "left")  # Get the side from the request
-                feedback = get_exercise_feedback(raw_landmarks, exercise_type, side) # Pass side
-
-        # Process Hands only if dumbbells are not already detected, unless squat
-        if not exercise_state.dumbbells_detected and exercise_type != "Squats":
-            hands_results = hands.process(frame_rgb)
-            if hands_results.multi_hand_landmarks:
-                for hand_landmark, hand_handedness in zip(hands_results.multi_hand_landmarks, hands_results.multi_handedness):
-                    hand_label = hand_handedness.classification[0].label.lower()
-                    landmarks_list = [
-                        {
-                            "id": idx,
-                            "x": lm.x,
-                            "y": lm.y,
-                            "z": lm.z,
-                            "visibility": lm.visibility
-                        }
-                        for idx, lm in enumerate(hand_landmark.landmark)
-                    ]
-                    hand_landmarks[f"{hand_label}_hand"] = landmarks_list
-
-                    # Determine if the hand is holding an object
-                    holding = is_hand_holding_object(hand_landmark.landmark)
-                    if hand_label == "left":
-                        holding_left = holding
-                    else:
-                        holding_right = holding
-
-        # Determine holding_dumbbell based on exercise type
-        if exercise_type == "Bicep Curl":
-            side = request.form.get("side", "left").lower()
-            hands_results = hands.process(frame_rgb)
-            if hands_results.multi_hand_landmarks:
-                for hand_landmark, hand_handedness in zip(hands_results.multi_hand_landmarks, hands_results.multi_handedness):
-                    hand_label = hand_handedness.classification[0].label.lower()
-            
-            # Process specific hand landmarks
-                if hand_label == "left":
-                    holding_left = is_hand_holding_object(hand_landmark.landmark)
-                elif hand_label == "right":
-                    holding_right = is_hand_holding_object(hand_landmark.landmark)
-            if side == "left":
-                holding_dumbbell = holding_left
-            else:
-                holding_dumbbell = holding_right
-        else:
-            holding_dumbbell = False
-            if holding_dumbbell:
-                exercise_state.dumbbell_detection_counter += 1
-            if exercise_state.dumbbell_detection_counter >= 3:
-                exercise_state.dumbbells_detected = True
-                logging.info(f"Dumbbell consistently detected in {side} hand. Starting rep tracking.")
-            else:
-                exercise_state.dumbbell_detection_counter = 0  # Reset counter if not detected
 
+@app.route("/process_landmarks", methods=["POST"])
+def process_landmarks():
+    """
+    Same counting and feedback as /process_frame for clients that run pose
+    estimation on-device, so the server does no image decoding or inference.
+    """
+    try:
+        data = read_json_object() if request.is_json else {}
+        exercise_type = data.get("exercise_type") or request.headers.get("X-Exercise-Type", "Lateral Raise")
+        side = data.get("side") or request.headers.get("X-Side", "left")
+        timestamp = parse_capture_timestamp(data.get("timestamp") or request.headers.get("X-Frame-Timestamp"))
+        pose_array, hands = read_uploaded_landmarks()
+
+        session = sessions.get(get_session_id())
+
+        with session.lock:
+            result = analyze_session_job(session, PrecomputedFrameJob(pose_array, hands), exercise_type, side, timestamp)
+        # The client already has its landmarks, don't echo them back
+        result["pose_landmarks"] = None
+        result["hand_landmarks"] = None
+        return encode_result(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error processing landmarks: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        if exercise_type != "Squats":
-            if holding_dumbbell:
-                exercise_state.dumbbell_detection_counter += 1
-                if exercise_state.dumbbell_detection_counter >= 3:
-                    exercise_state.dumbbells_detected = True
-                    exercise_state.holding_dumbbells_overall = True
-                    logging.info("Both dumbbells consistently detected. Starting exercise tracking.")
-            else:
-                exercise_state.dumbbell_detection_counter = 0  # Reset counter if not detected
-                exercise_state.holding_dumbbells_overall = False
-        elif exercise_type == "Squats":
-            # For squats, immediately enable tracking
-            if not exercise_state.squat_started:
-                exercise_state.squat_started = True
-                feedback = (
-                    f"Stand with feet shoulder-width apart to begin squats. "
-                    f"Squat down until your hips are close to your knees and hold for {exercise_state.HOLD_REQUIRED_SECONDS} second(s)."
-                )
-                logging.info("Squat exercise started without dumbbells.")
-            holding_dumbbell = True
-            exercise_state.dumbbells_detected = True
-
-        return jsonify({
-            "pose_landmarks": landmarks,
-            "hand_landmarks": hand_landmarks if not exercise_state.dumbbells_detected else None,
-            "rep_count": rep_count,
-            "feedback": feedback,
-            "holding_dumbbell": holding_dumbbell,
-            "holding_dumbbells_overall": exercise_state.holding_dumbbells_overall,
-            "dumbbells_detected": exercise_state.dumbbells_detected
-        }), 200
+
+@app.route("/analyze_video", methods=["POST"])
+def analyze_video_upload():
+    """
+    Counts reps in a recorded set. The upload is streamed to a temporary file
+    and decoded one frame at a time; the response has the rep count, a
+    timeline with one entry per rep and the processing throughput. With
+    VIDEO_WORKERS > 1 the video is analyzed in chunks by that many processes.
+    """
+    if "video" not in request.files:
+        return jsonify({"error": "No video provided"}), 400
+
+    upload = request.files["video"]
+    suffix = os.path.splitext(upload.filename or "")[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as video_file:
+        path = video_file.name
+    try:
+        upload.save(path)
+        exercise_type = request.form.get("exercise_type", "Lateral Raise")
+        side = request.form.get("side", "left")
+        frame_step = int(request.form.get("frame_step", 1))
+        if VIDEO_WORKERS > 1:
+            report = analyze_video_parallel(path, exercise_type, side, frame_step)
+        else:
+            report = analyze_video(
+                path, exercise_type, side, frame_step,
+                backend=get_inference_backend(),
+                session_id=f"video-{uuid.uuid4()}",  # Own tracking state in the graph pools
+            )
+        return jsonify(report), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logging.error(f"Error processing frame: {e}")
+        logging.error(f"Error analyzing video: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        os.remove(path)
 
 
 @app.route("/reset_exercise", methods=["POST"])
 def reset_exercise():
-        reset_exercise_state()
-        exercise_state.holding_dumbbells_overall = False  # Reset holding status
-        exercise_state.dumbbell_detection_counter = 0  # Reset detection counter
-        logging.info("Exercise state has been reset.")
+        session_id = get_session_id()
+        sessions.reset(session_id)  # Only the caller's session is touched
+        logging.info(f"Exercise state has been reset for session {session_id}.")
         return jsonify({"message": "Exercise state reset"}), 200
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    counters = metrics.snapshot()
+    frames = counters.get("frames_inferred", 0)
+    counters["hands_inferences_per_frame"] = counters.get("hands_inferences", 0) / frames if frames else 0.0
+    # Share of the frames that needed hands where the schedule saved the inference
+    wanted = counters.get("hands_inferences", 0) + counters.get("hands_skipped", 0)
+    counters["hands_skip_ratio"] = counters.get("hands_skipped", 0) / wanted if wanted else 0.0
+    gated = counters.get("frame_gate_hits", 0) + counters.get("frame_gate_misses", 0)
+    counters["frame_gate_hit_rate"] = counters.get("frame_gate_hits", 0) / gated if gated else 0.0
+    counters["active_sessions"] = len(sessions)
+    return jsonify(counters), 200
+
+##############################################################################
+# WEBSOCKET FRAME STREAMING
+##############################################################################
+
+# Clients emit "frame" events with {"frame": <jpeg bytes>, "exercise_type",
+# "side", "session_id", "frame_id"} (raw pixels add "format", "width" and
+# "height", see decode_raw_frame) and get a "frame_result" (or "frame_error")
+# back for each one, tagged with the same frame_id. Frames that also carry an
+# increasing "seq" are dropped with a "frame_dropped" event once a newer frame
+# of the session has arrived (see FrameMailbox), and a "timestamp" (capture
+# time in ms) times squat holds by the client's clock. The connection stays open
+# for the whole workout, so there is no per-frame HTTP setup, and the client
+# can send the next frame before the previous result arrives.
+
+def get_socket_session_id(data):
+    return data.get("session_id") or request.sid  # Fall back to one session per connection
+
+
+@socketio.on("frame")
+def stream_frame(data):
+    frame_id = None
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("Frame payload must be an object")
+        frame_id = data.get("frame_id")
+        exercise_type = data.get("exercise_type", "Lateral Raise")
+        side = data.get("side", "left")
+        seq = parse_frame_seq(data.get("seq"))
+        timestamp = parse_capture_timestamp(data.get("timestamp"))
+        session = sessions.get(get_socket_session_id(data))
+        if seq is not None:
+            session.mailbox.post(seq)
+
+        with session.lock:
+            if seq is not None and not session.mailbox.claim(seq):
+                emit("frame_dropped", {
+                    "frame_id": frame_id,
+                    "seq": seq,
+                    "latest_seq": session.mailbox.newest_seq,
+                    "dropped_frames": session.mailbox.dropped,
+                })
+                return
+            if data.get("format"):
+                frame_rgb = decode_raw_frame(
+                    data["frame"], data["format"], data.get("width", 0), data.get("height", 0), session.frame_buffers
+                )
+            else:
+                frame_rgb = decode_frame(data["frame"], session.frame_buffers)
+            result = result_to_json(analyze_session_frame(session, frame_rgb, exercise_type, side, timestamp))
+        result["frame_id"] = frame_id
+        if seq is not None:
+            result["seq"] = seq
+            result["dropped_frames"] = session.mailbox.dropped
+        emit("frame_result", result)
+    except Exception as e:
+        logging.error(f"Error processing streamed frame: {e}")
+        emit("frame_error", {"frame_id": frame_id, "error": str(e)})
+
+
+@socketio.on("reset_exercise")
+def stream_reset_exercise(data=None):
+    session_id = get_socket_session_id(data if isinstance(data, dict) else {})
+    sessions.reset(session_id)
+    logging.info(f"Exercise state has been reset for session {session_id}.")
+    emit("exercise_reset", {"session_id": session_id})
+
 ##############################################################################
 # GEMINI AI DIET & WORKOUT PLAN ROUTES
 ##############################################################################
@@ -800,6 +1004,7 @@ def workout_plan():
 ##############################################################################
 
 if __name__ == "__main__":
-    reset_exercise_state()
     logging.info("Starting Gymfluencer API Server...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Werkzeug's development server, as app.run was; it refuses to start without
+    # a TTY (docker, systemd, nohup) unless explicitly allowed
+    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
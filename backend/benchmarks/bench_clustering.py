@@ -0,0 +1,62 @@
+"""
+Benchmark of the landmark clustering check.
+
+Compares the original pure-Python double loop (45 pairs, math.sqrt each)
+with the vectorized and early-exit versions in exercises.py, one frame at a
+time and (vectorized only) over a whole batch of frames in one call, and
+checks that they all agree. Run from backend/:
+
+    python -m benchmarks.bench_clustering
+"""
+import math
+import timeit
+import numpy as np
+from exercises import (
+    CLUSTER_CHECK_LANDMARKS, CLUSTER_MIN_DISTANCE,
+    are_landmarks_too_clustered, are_landmarks_too_clustered_early_exit,
+)
+
+
+def are_landmarks_too_clustered_loop(landmarks):
+    """The original implementation: double loop with a sqrt per pair."""
+    points = landmarks[CLUSTER_CHECK_LANDMARKS, :2].tolist()
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            dx = points[i][0] - points[j][0]
+            dy = points[i][1] - points[j][1]
+            if math.sqrt(dx**2 + dy**2) < CLUSTER_MIN_DISTANCE:
+                return True
+    return False
+
+
+def make_frames(count, spread, seed=0):
+    """Random poses; a smaller spread packs the joints closer together."""
+    rng = np.random.default_rng(seed)
+    frames = np.zeros((count, 33, 4), dtype=np.float32)
+    frames[:, :, :2] = 0.5 + rng.uniform(-spread, spread, (count, 33, 2))
+    frames[:, :, 3] = 1.0
+    return frames
+
+
+def main():
+    implementations = [
+        ("loop (original)", are_landmarks_too_clustered_loop),
+        ("vectorized", are_landmarks_too_clustered),
+        ("early exit", are_landmarks_too_clustered_early_exit),
+    ]
+    # Well separated poses (the common, all-pairs case) vs. a user too close to the camera
+    for label, spread in (("spread out", 3.0), ("clustered", 0.1)):
+        frames = make_frames(2000, spread)
+        expected = [are_landmarks_too_clustered_loop(frame) for frame in frames]
+        print(f"{label}: {sum(expected)}/{len(frames)} frames too clustered")
+        for name, check in implementations:
+            assert [check(frame) for frame in frames] == expected, f"{name} disagrees with the loop"
+            seconds = min(timeit.repeat(lambda: [check(frame) for frame in frames], number=1, repeat=5))
+            print(f"  {name:<24} {seconds / len(frames) * 1e6:7.2f} us/frame")
+        assert are_landmarks_too_clustered(frames).tolist() == expected, "batch call disagrees with the loop"
+        seconds = min(timeit.repeat(lambda: are_landmarks_too_clustered(frames), number=1, repeat=5))
+        print(f"  {'vectorized, whole batch':<24} {seconds / len(frames) * 1e6:7.2f} us/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the joint angle kernel.
+
+Computes all JOINT_ANGLE_TRIPLES angles of each frame with the original
+calculate_angle (one call per joint, on Python floats), with one
+joint_angles call per frame and with one joint_angles call for the whole
+batch. Then times the one angle a Bicep Curl frame reads (left elbow), with
+the original, with the "left_elbow_angle" feature the live path evaluates
+and with the kernel. Checks that calculate_angle and the feature still
+return the original's angles exactly, and that the kernel returns the same
+angles for a frame whether it runs on that frame alone or on the whole
+batch, within the last bit of the original's. Run from backend/:
+
+    python -m benchmarks.bench_joint_angles
+"""
+import math
+import timeit
+import numpy as np
+from exercises import JOINT_ANGLE_TRIPLES, FrameFeatures, calculate_angle, joint_angles
+from benchmarks.bench_clustering import make_frames
+
+
+def calculate_angle_original(A, B, C):
+    """The original implementation: one joint per call, on (x, y) Python floats."""
+    BA = (A[0] - B[0], A[1] - B[1])
+    BC = (C[0] - B[0], C[1] - B[1])
+
+    dot_product = BA[0]*BC[0] + BA[1]*BC[1]
+    magBA = math.sqrt(BA[0]**2 + BA[1]**2)
+    magBC = math.sqrt(BC[0]**2 + BC[1]**2)
+
+    if magBA == 0 or magBC == 0:
+        return 0.0
+
+    cos_angle = dot_product / (magBA * magBC)
+    cos_angle = max(min(cos_angle, 1.0), -1.0)
+    angle = math.degrees(math.acos(cos_angle))
+    return angle
+
+
+def original_angles(points, triples):
+    return [calculate_angle_original(points[a], points[b], points[c]) for a, b, c in triples]
+
+
+def main():
+    frames = make_frames(2000, 0.3)
+    frames[::50, 13, :2] = frames[::50, 11, :2]  # Some elbows on their shoulder, angle 0
+    triples = list(JOINT_ANGLE_TRIPLES.values())
+
+    # The original read the landmarks as Python floats (protobuf attributes)
+    points = [frame[:, :2].tolist() for frame in frames]
+
+    batch = joint_angles(frames)
+    per_frame = np.array([joint_angles(frame) for frame in frames])
+    per_joint = np.array([[calculate_angle(frame, *triple) for triple in triples] for frame in frames])
+    original = np.array([original_angles(frame_points, triples) for frame_points in points])
+    assert (per_joint == original).all(), "calculate_angle disagrees with the original"
+    assert (batch == per_frame).all(), "kernel results depend on the batch"
+    # NumPy's arccos may round the last bit differently from math.acos
+    assert np.allclose(batch, original, rtol=0, atol=1e-9), "kernel disagrees with the original"
+    print(f"{len(triples)} joints x {len(frames)} frames, max difference from the original "
+          f"{np.abs(batch - original).max():.1e} degrees")
+
+    elbow = [JOINT_ANGLE_TRIPLES["left_elbow"]]
+    feature = np.array([FrameFeatures(frame)["left_elbow_angle"] for frame in frames])
+    assert (feature == original[:, 0]).all(), "left_elbow_angle disagrees with the original"
+
+    runs = [
+        (f"all {len(triples)} joints", [
+            ("original", lambda: [original_angles(frame_points, triples) for frame_points in points]),
+            ("kernel, per frame", lambda: [joint_angles(frame) for frame in frames]),
+            ("kernel, whole batch", lambda: joint_angles(frames)),
+        ]),
+        ("left elbow only", [
+            ("original", lambda: [original_angles(frame_points, elbow) for frame_points in points]),
+            ("feature, per frame", lambda: [FrameFeatures(frame)["left_elbow_angle"] for frame in frames]),
+            ("kernel, per frame", lambda: [joint_angles(frame, elbow) for frame in frames]),
+        ]),
+    ]
+    for title, timings in runs:
+        print(f"{title}:")
+        for name, run in timings:
+            seconds = min(timeit.repeat(run, number=1, repeat=5))
+            print(f"  {name:<20} {seconds / len(frames) * 1e6:7.2f} us/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark of offline rep counting.
+
+Counts reps over synthetic landmark time series with the live path
+(evaluate_exercise called frame by frame) and with count_reps_offline, checks
+that the per-frame counts, the rep frames and the final state agree, also
+when the series is counted in two halves that share one ExerciseState, and
+times both. The series include frames without a pose and frames captured
+out of order. Run from backend/:
+
+    python -m benchmarks.bench_rep_counting
+"""
+import logging
+import timeit
+import numpy as np
+from exercises import ExerciseState, HOLD_REQUIRED_SECONDS, count_reps_offline, evaluate_exercise
+
+EXERCISES = [("Lateral Raise", "left"), ("Shoulder Press", "left"), ("Bicep Curl", "left"),
+             ("Bicep Curl", "right"), ("Squats", "left")]
+FPS = 30.0
+
+
+def make_series(count, seed=0):
+    """
+    Random smooth motion: every joint drifts around a spread-out standing pose
+    along a few slow sinusoids, so all the state machines keep changing state.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.zeros((33, 2))
+    base[:, 0] = np.linspace(0.1, 0.9, 33)
+    base[:, 1] = rng.uniform(0.2, 0.8, 33)
+    t = np.arange(count)[:, None, None] / FPS
+    frequency = rng.uniform(0.05, 0.6, (4, 33, 2))
+    phase = rng.uniform(0, 2 * np.pi, (4, 33, 2))
+    motion = sum(0.12 * np.sin(2 * np.pi * frequency[k] * t + phase[k]) for k in range(4))
+    landmarks = np.zeros((count, 33, 4), dtype=np.float32)
+    landmarks[:, :, :2] = base + motion + rng.normal(0, 0.01, (count, 33, 2))
+    landmarks[:, :, 3] = 1.0
+    landmarks[rng.random(count) < 0.02] = np.nan  # No pose detected
+    timestamps = np.arange(count) / FPS
+    late = rng.random(count) < 0.01  # Arrived after a newer frame
+    timestamps[late] -= rng.uniform(0.05, 0.5, late.sum())
+    return landmarks, timestamps
+
+
+def count_online(landmarks, timestamps, exercise_type, side, exercise_state):
+    counts = []
+    for frame, timestamp in zip(landmarks, timestamps):
+        if not np.isnan(frame).any():
+            evaluate_exercise(frame, exercise_type, exercise_state, side, float(timestamp))
+        counts.append(exercise_state.rep_count)
+    return np.array(counts)
+
+
+def state_fields(exercise_state):
+    return (exercise_state.rep_count, exercise_state.position_state, exercise_state.previous_position_state,
+            exercise_state.squat_hold_start_time, exercise_state.last_timestamp)
+
+
+def main():
+    logging.disable(logging.INFO)
+    landmarks, timestamps = make_series(20000)
+    half = len(landmarks) // 2
+    for exercise_type, side in EXERCISES:
+        online_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+        online = count_online(landmarks, timestamps, exercise_type, side, online_state)
+        offline_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+        offline = count_reps_offline(landmarks, timestamps, exercise_type, side, offline_state)
+        assert (offline["counts"] == online).all(), f"{exercise_type}: per-frame counts differ"
+        assert offline["rep_frames"].tolist() == np.flatnonzero(np.diff(online, prepend=0)).tolist()
+        assert state_fields(offline_state) == state_fields(online_state), f"{exercise_type}: final state differs"
+
+        split_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+        first = count_reps_offline(landmarks[:half], timestamps[:half], exercise_type, side, split_state)
+        second = count_reps_offline(landmarks[half:], timestamps[half:], exercise_type, side, split_state)
+        assert (np.r_[first["counts"], second["counts"]] == online).all(), f"{exercise_type}: halves differ"
+        assert state_fields(split_state) == state_fields(online_state)
+
+        online_seconds = min(timeit.repeat(
+            lambda: count_online(landmarks, timestamps, exercise_type, side, ExerciseState()), number=1, repeat=3))
+        offline_seconds = min(timeit.repeat(
+            lambda: count_reps_offline(landmarks, timestamps, exercise_type, side), number=1, repeat=3))
+        print(f"{exercise_type} ({side}): {offline['rep_count']} reps in {len(landmarks)} frames")
+        print(f"  {'frame by frame':<16} {online_seconds / len(landmarks) * 1e6:7.2f} us/frame")
+        print(f"  {'offline':<16} {offline_seconds / len(landmarks) * 1e6:7.2f} us/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,836 @@
+import math
+import logging
+import time  # Import time module
+import numpy as np
+
+##############################################################################
+# EXERCISE STATE (3-STATE MACHINE)
+##############################################################################
+
+
+class ExerciseState:
+    def __init__(self, hold_required_seconds=1):
+        self.rep_count = 0
+        self.position_state = 0
+        self.previous_position_state = 0
+        self.holding_dumbbells_overall = False
+        self.dumbbells_detected = False
+        self.dumbbell_detection_counter = 0
+        self.squat_started = False  # Flag for squat start
+        self.squat_hold_start_time = None  # Timestamp when squat hold starts
+        self.last_timestamp = None  # Capture time of the latest frame counted
+        self.last_feedback = None
+        self.HOLD_REQUIRED_SECONDS = hold_required_seconds  # Manually set hold duration
+
+    def reset(self):
+        self.rep_count = 0
+        self.position_state = 0
+        self.previous_position_state = 0
+        self.holding_dumbbells_overall = False
+        self.dumbbells_detected = False
+        self.dumbbell_detection_counter = 0
+        self.squat_started = False  # Reset squat start flag
+        self.squat_hold_start_time = None  # Reset squat hold timestamp
+        self.last_timestamp = None
+        self.last_feedback = None
+
+
+# Initialize the ExerciseState with the configured hold duration
+HOLD_REQUIRED_SECONDS = 1  # Manually set hold duration in seconds
+
+##############################################################################
+# LANDMARK ARRAY LAYOUT
+##############################################################################
+
+# Every function below takes the frame's pose as one (33, 4) float32 array of
+# (x, y, z, visibility) rows, indexed by these MediaPipe pose landmark ids.
+X, Y, Z, VISIBILITY = 0, 1, 2, 3
+NOSE = 0
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_ELBOW, RIGHT_ELBOW = 13, 14
+LEFT_WRIST, RIGHT_WRIST = 15, 16
+LEFT_HIP, RIGHT_HIP = 23, 24
+LEFT_KNEE, RIGHT_KNEE = 25, 26
+LEFT_ANKLE, RIGHT_ANKLE = 27, 28
+
+# Landmarks checked by are_landmarks_too_clustered
+CLUSTER_CHECK_LANDMARKS = [
+    LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW, RIGHT_ELBOW, LEFT_WRIST,
+    RIGHT_WRIST, LEFT_HIP, RIGHT_HIP, LEFT_KNEE, RIGHT_KNEE,
+]
+
+
+CLUSTER_MIN_DISTANCE = 0.1  # Minimum allowed distance between points
+CLUSTER_MIN_DISTANCE_SQ = CLUSTER_MIN_DISTANCE ** 2  # Compared against squared distances, no sqrt
+
+_CLUSTER_INDICES = np.array(CLUSTER_CHECK_LANDMARKS)
+# Added to the 10 x 10 squared-distance matrix so only the 45 pairs above the
+# diagonal can fall under the threshold
+_CLUSTER_PAIR_BIAS = np.where(np.triu(np.ones((10, 10), dtype=bool), k=1), 0.0, np.inf).astype(np.float32)
+
+# Pairs in the order the early-exit variant tries them: joints that are
+# neighbours on the skeleton (and so the likeliest to overlap) first.
+_NEIGHBOUR_PAIRS = [(0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (0, 6), (1, 7), (6, 7), (6, 8), (7, 9)]
+_CLUSTER_PAIRS_EARLY_EXIT = _NEIGHBOUR_PAIRS + [
+    (i, j) for i in range(10) for j in range(i + 1, 10) if (i, j) not in _NEIGHBOUR_PAIRS
+]
+
+
+def are_landmarks_too_clustered(landmarks):
+    """
+    Checks if the specified landmarks are too close to each other.
+    This can help in determining if the user is too close to the camera or if the detection is unreliable.
+    Takes one (33, 4) frame or a (T, 33, 4) batch, returning a bool or a (T,)
+    bool array. The (x, y) rows are viewed as complex numbers so all pairwise
+    squared distances come out of one broadcast subtraction.
+    """
+    points = landmarks[..., _CLUSTER_INDICES, :2]
+    points = points.view(np.complex64 if points.dtype == np.float32 else np.complex128)
+    diff = points - np.swapaxes(points, -1, -2)
+    diff *= diff.conj()  # |a - b|^2 in the real part
+    too_close = (diff.real + _CLUSTER_PAIR_BIAS).min(axis=(-2, -1)) < CLUSTER_MIN_DISTANCE_SQ
+    if too_close.ndim:
+        return too_close
+    if too_close:
+        logging.debug("Some landmarks are too close to each other")
+    return bool(too_close)
+
+
+def are_landmarks_too_clustered_early_exit(landmarks):
+    """
+    Same answer as are_landmarks_too_clustered for a single frame, but walks
+    the pairs in plain Python (neighbouring joints first) and returns at the
+    first close pair. For one frame at a time this beats the NumPy version,
+    whose fixed per-call overhead outweighs 45 pairs (see
+    benchmarks/bench_clustering.py), so the per-frame counters use it.
+    """
+    # .item() per value: cheaper than a fancy-index gather for 10 points
+    points = [(landmarks.item(index, X), landmarks.item(index, Y)) for index in CLUSTER_CHECK_LANDMARKS]
+    for i, j in _CLUSTER_PAIRS_EARLY_EXIT:
+        dx = points[i][0] - points[j][0]
+        dy = points[i][1] - points[j][1]
+        if dx * dx + dy * dy < CLUSTER_MIN_DISTANCE_SQ:
+            logging.debug(f"Landmarks {i} and {j} are too close")
+            return True
+    return False
+
+##############################################################################
+# JOINT ANGLES
+##############################################################################
+
+# Joint -> (a, b, c) landmark triple whose angle at b is the joint angle
+JOINT_ANGLE_TRIPLES = {
+    "left_elbow": (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST),
+    "right_elbow": (RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST),
+    "left_shoulder": (LEFT_ELBOW, LEFT_SHOULDER, LEFT_HIP),
+    "right_shoulder": (RIGHT_ELBOW, RIGHT_SHOULDER, RIGHT_HIP),
+    "left_hip": (LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE),
+    "right_hip": (RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE),
+    "left_knee": (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE),
+    "right_knee": (RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE),
+}
+JOINT_NAMES = list(JOINT_ANGLE_TRIPLES)
+_JOINT_INDICES = np.array(list(JOINT_ANGLE_TRIPLES.values())).T  # (3, joints): all a, all b, all c
+
+
+def calculate_point_angle(A, B, C):
+    """
+    Calculates the angle at point B formed by points A, B, and C.
+    """
+    BA = (A[0] - B[0], A[1] - B[1])
+    BC = (C[0] - B[0], C[1] - B[1])
+
+    dot_product = BA[0]*BC[0] + BA[1]*BC[1]
+    magBA = math.sqrt(BA[0]**2 + BA[1]**2)
+    magBC = math.sqrt(BC[0]**2 + BC[1]**2)
+
+    if magBA == 0 or magBC == 0:
+        return 0.0
+
+    cos_angle = dot_product / (magBA * magBC)
+    cos_angle = max(min(cos_angle, 1.0), -1.0)
+    angle = math.degrees(math.acos(cos_angle))
+    return angle
+
+
+def joint_angles(landmarks, triples=None):
+    """
+    Angles in degrees at b of every (a, b, c) landmark triple, in one set of
+    NumPy operations over all triples at once: (joints,) for one (33, 4)
+    frame, (T, joints) for a (T, 33, 4) batch. `triples` defaults to all of
+    JOINT_ANGLE_TRIPLES, in JOINT_NAMES order. A joint whose neighbouring
+    landmark sits on it has angle 0. The math is calculate_point_angle's in
+    float64; NumPy's arccos may round the last bit differently from
+    math.acos. For a single frame, calculate_point_angle on Python floats is
+    several times faster; the kernel is for batches.
+    """
+    indices = _JOINT_INDICES if triples is None else np.array(triples).T
+    points = landmarks[..., indices, :2].astype(np.float64)  # (..., 3, joints, 2) in one gather
+    BA_BC = points[..., 0::2, :, :] - points[..., 1:2, :, :]  # (..., 2, joints, 2)
+
+    magnitudes = np.sqrt(BA_BC[..., 0] ** 2 + BA_BC[..., 1] ** 2)  # |BA| and |BC|, (..., 2, joints)
+    BA, BC = BA_BC[..., 0, :, :], BA_BC[..., 1, :, :]
+    dot = BA[..., 0] * BC[..., 0] + BA[..., 1] * BC[..., 1]
+
+    product = magnitudes[..., 0, :] * magnitudes[..., 1, :]
+    cos_angle = np.divide(dot, product, out=np.ones_like(dot), where=product != 0)
+    np.minimum(np.maximum(cos_angle, -1.0, out=cos_angle), 1.0, out=cos_angle)  # Clip without np.clip's overhead
+    angles = np.degrees(np.arccos(cos_angle))
+    angles[(magnitudes == 0).any(axis=-2)] = 0.0
+    return angles
+
+
+def calculate_angle(landmarks, a, b, c):
+    """
+    Calculates the angle at landmark b formed by landmarks a, b, and c.
+    A float for one (33, 4) frame, a (T,) array for a (T, 33, 4) batch; see
+    joint_angles for several joints at once.
+    """
+    if landmarks.ndim == 2:
+        A, B, C = ((landmarks.item(index, X), landmarks.item(index, Y)) for index in (a, b, c))
+        return calculate_point_angle(A, B, C)
+    return joint_angles(landmarks, [(a, b, c)])[:, 0]
+
+##############################################################################
+# EXERCISE STATE-MACHINE ENGINE
+##############################################################################
+
+FEATURES = {}  # Frame feature name -> function computing it from a FrameFeatures
+
+
+def feature(function):
+    """Registers a frame feature under the function's name."""
+    FEATURES[function.__name__] = function
+    return function
+
+
+class FrameFeatures(dict):
+    """
+    The features of one (33, 4) frame, computed on first use and then kept, so
+    a feature read by several predicates and messages is computed once.
+    Features read coordinates through y() and xy() as Python floats: for one
+    frame, plain float math costs less than NumPy operations on the array.
+    """
+
+    __slots__ = ("landmarks", "side")
+    batch = False
+
+    def __init__(self, landmarks, side="left"):
+        self["side"] = side  # Cheaper than dict.__init__(side=side), and this runs every frame
+        self.landmarks = landmarks
+        self.side = side
+
+    def __missing__(self, name):
+        value = self[name] = FEATURES[name](self)
+        return value
+
+    def y(self, index):
+        return self.landmarks.item(index, Y)
+
+    def xy(self, index):
+        return self.landmarks.item(index, X), self.landmarks.item(index, Y)
+
+
+class BatchFeatures(FrameFeatures):
+    """
+    The same features for a (T, 33, 4) batch, with one value per frame.
+    Coordinates are read in float64, so the arithmetic rounds like the
+    Python floats of a single frame.
+    """
+
+    __slots__ = ()
+    batch = True
+
+    def y(self, index):
+        return self.landmarks[:, index, Y].astype(np.float64)
+
+
+REP = True  # Marks the transitions that count a rep
+
+# Predicates the engine provides for exercises with a hold_state; all other
+# predicate names are FEATURES
+HOLD_PREDICATES = {"hold_started", "hold_complete", "hold_just_abandoned"}
+
+
+class Predicate:
+    """
+    A predicate like "a and not b" (None always holds), compiled into
+    `holds(features)` for one frame and `mask(features, frames)` for a batch.
+    """
+
+    __slots__ = ("terms", "holds")
+
+    def __init__(self, text):
+        self.terms = tuple(
+            (term[4:], False) if term.startswith("not ") else (term, True)
+            for term in (text.split(" and ") if text else ())
+        )
+        self.holds = self._compile(self.terms)
+
+    @staticmethod
+    def _compile(terms):
+        # One closure per shape, so a frame costs a call and a lookup per term
+        if not terms:
+            return lambda features: True
+        if len(terms) == 1:
+            (name, expected), = terms
+            if expected:
+                return lambda features: bool(features[name])
+            return lambda features: not features[name]
+
+        def holds(features):
+            for name, expected in terms:
+                if bool(features[name]) != expected:
+                    return False
+            return True
+        return holds
+
+    def mask(self, features, frames):
+        mask = np.ones(frames, dtype=bool)
+        for name, expected in self.terms:
+            mask &= features[name] if expected else ~features[name]
+        return mask
+
+
+class ExerciseDefinition:
+    """
+    One exercise as data, compiled once into its per-frame evaluator:
+      transitions     {state: [(predicate, next_state[, REP])]}; the first
+                      predicate that holds moves the state, REP counts a rep
+      feedback        {state: [(predicate, message)]} for the state after the
+                      transition; the first that holds (None always does) is sent
+      skip_when       frames whose landmarks are too unreliable to move the state
+      hold_state      state that has to be held for HOLD_REQUIRED_SECONDS; its
+                      timer starts on entering it and stops back in state 0
+      uses_dumbbells  whether analyze_frame looks for dumbbells in the hands
+      single_arm      whether only the hand on the tracked side counts
+    Predicates are feature names joined by "and", each optionally negated with
+    "not". Messages are format strings over the features, {side} and, with a
+    hold, {hold_seconds} and {remaining_time}. State 0 is the starting
+    position.
+    """
+
+    def __init__(self, name, transitions, feedback, skip_when=None, hold_state=None,
+                 uses_dumbbells=True, single_arm=False):
+        self.name = name
+        self.transitions = {
+            state: tuple((Predicate(rule[0]), rule[1], len(rule) > 2 and rule[2]) for rule in rules)
+            for state, rules in transitions.items()
+        }
+        # Messages without fields are sent as they are
+        self.feedback = {
+            state: tuple((Predicate(predicate), message, "{" in message) for predicate, message in rules)
+            for state, rules in feedback.items()
+        }
+        self.skip_when = Predicate(skip_when) if skip_when else None
+        self.hold_state = hold_state
+        self.uses_dumbbells = uses_dumbbells
+        self.single_arm = single_arm
+
+        predicates = [rule[0] for rules in self.transitions.values() for rule in rules]
+        predicates += [rule[0] for rules in self.feedback.values() for rule in rules]
+        if self.skip_when is not None:
+            predicates.append(self.skip_when)
+        for name, _ in (term for predicate in predicates for term in predicate.terms):
+            if name not in FEATURES and not (hold_state is not None and name in HOLD_PREDICATES):
+                raise ValueError(f"{self.name}: unknown predicate {name!r}")
+
+    def evaluate(self, landmarks, exercise_state, current_time, side="left"):
+        """Advances exercise_state by one frame and returns (rep_count, feedback)."""
+        features = FrameFeatures(landmarks, side)
+        state = exercise_state.position_state
+        if self.hold_state is not None:
+            self._hold_features(features, exercise_state, current_time)
+
+        if self.skip_when is not None and self.skip_when.holds(features):
+            logging.debug("Landmarks are too clustered. Skipping rep count.")
+        else:
+            for predicate, next_state, counts_rep in self.transitions.get(state, ()):
+                if predicate.holds(features):
+                    self._move(exercise_state, next_state, counts_rep, current_time, side)
+                    break
+
+        if self.hold_state is not None:
+            exercise_state.previous_position_state = state
+            self._hold_features(features, exercise_state, current_time)
+        for predicate, message, has_fields in self.feedback[exercise_state.position_state]:
+            if predicate.holds(features):
+                return exercise_state.rep_count, message.format_map(features) if has_fields else message
+        return exercise_state.rep_count, None
+
+    def _move(self, exercise_state, next_state, counts_rep, current_time, side):
+        logging.debug(f"{self.name}: state {exercise_state.position_state} -> {next_state}")
+        exercise_state.position_state = next_state
+        if counts_rep:
+            exercise_state.rep_count += 1
+            arm = f" ({side})" if self.single_arm else ""
+            logging.info(f"{self.name}{arm} Rep Count: {exercise_state.rep_count}")
+        if self.hold_state is not None:
+            if next_state == self.hold_state:
+                exercise_state.squat_hold_start_time = current_time  # Start hold timer
+            elif next_state == 0:
+                exercise_state.squat_hold_start_time = None
+
+    def _hold_features(self, features, exercise_state, current_time):
+        hold_start = exercise_state.squat_hold_start_time
+        held = 0.0 if hold_start is None else current_time - hold_start
+        features["hold_started"] = hold_start is not None
+        features["hold_complete"] = hold_start is not None and held >= exercise_state.HOLD_REQUIRED_SECONDS
+        features["hold_seconds"] = exercise_state.HOLD_REQUIRED_SECONDS
+        features["remaining_time"] = exercise_state.HOLD_REQUIRED_SECONDS - held
+        # The hold was given up on the previous frame; it can't restart right away
+        features["hold_just_abandoned"] = exercise_state.previous_position_state == self.hold_state
+
+##############################################################################
+# SHARED FRAME FEATURES
+##############################################################################
+
+_CLUSTER_BLOCK_FRAMES = 4096  # Bounds the (T, 10, 10) temporaries of the batch clustering check
+
+
+@feature
+def too_clustered(frame):
+    landmarks = frame.landmarks
+    if not frame.batch:
+        return are_landmarks_too_clustered_early_exit(landmarks)
+    # In float64, so every pair distance rounds exactly like the Python floats
+    # of the early-exit check
+    return np.concatenate([
+        are_landmarks_too_clustered(landmarks[start:start + _CLUSTER_BLOCK_FRAMES].astype(np.float64))
+        for start in range(0, len(landmarks), _CLUSTER_BLOCK_FRAMES)
+    ] or [np.zeros(0, dtype=bool)])
+
+@feature
+def joint_angles_all(frame):
+    """Every JOINT_ANGLE_TRIPLES angle of a batch, from one joint_angles call."""
+    return joint_angles(frame.landmarks)
+
+
+def _joint_angle_feature(column):
+    a, b, c = _JOINT_INDICES[:, column].tolist()
+
+    def angle(frame):
+        if frame.batch:
+            return frame["joint_angles_all"][:, column]
+        return calculate_point_angle(frame.xy(a), frame.xy(b), frame.xy(c))
+    return angle
+
+
+# "<joint>_angle" features (left_elbow_angle, right_knee_angle, ...). A single
+# frame computes only the joints its exercise reads; a batch computes all of
+# them in one kernel call and reads a column
+for _column, _joint in enumerate(JOINT_NAMES):
+    FEATURES[f"{_joint}_angle"] = _joint_angle_feature(_column)
+
+##############################################################################
+# 1) LATERAL RAISE (Chest line check only, no angles)
+##############################################################################
+
+@feature
+def chest_y(frame):
+    """The chest line: midpoint of the shoulders."""
+    return (frame.y(LEFT_SHOULDER) + frame.y(RIGHT_SHOULDER)) / 2
+
+@feature
+def arms_up(frame):
+    # Arms up => both wrists above chest line => y < chest_y
+    chest_y = frame["chest_y"]
+    return (frame.y(LEFT_WRIST) < chest_y) & (frame.y(RIGHT_WRIST) < chest_y)
+
+@feature
+def arms_down(frame):
+    # Arms down => both wrists below chest line => y > chest_y
+    chest_y = frame["chest_y"]
+    return (frame.y(LEFT_WRIST) > chest_y) & (frame.y(RIGHT_WRIST) > chest_y)
+
+# 3-state logic for Lateral Raise using only the chest line:
+#   - State 0 => arms down (wrists below chest line)
+#   - State 1 => arms up (wrists above chest line)
+#   - State 2 => returning down
+#   A rep is counted after arms fully return down from being up.
+LATERAL_RAISE = ExerciseDefinition(
+    "Lateral Raise",
+    transitions={
+        0: [("arms_up", 1)],
+        1: [("not arms_up", 2)],
+        2: [("arms_down", 0, REP)],
+    },
+    feedback={
+        0: [("arms_up", "Arms raised! Now lower them back down slowly."),
+            (None, "Arms down. Raise both wrists above your chest.")],
+        1: [("not arms_up", "Lower your arms slowly to finish the rep."),
+            (None, "Hold arms above your chest line, then start lowering.")],
+        2: [("arms_down", "Rep complete! Arms fully down. Get ready for the next raise."),
+            (None, "Keep lowering until your wrists are below your chest line.")],
+    },
+    skip_when="too_clustered",
+)
+
+##############################################################################
+# 2) SHOULDER PRESS (Angle + Nose crossing)
+##############################################################################
+
+# Elbow angle range of the starting position (~90°)
+START_ANGLE_LOW = 70
+START_ANGLE_HIGH = 110
+
+@feature
+def elbow_above_nose(frame):
+    return frame.y(LEFT_ELBOW) < frame.y(NOSE)
+
+@feature
+def elbow_under_start_angle(frame):
+    return frame["left_elbow_angle"] < START_ANGLE_LOW
+
+@feature
+def elbow_over_start_angle(frame):
+    return frame["left_elbow_angle"] > START_ANGLE_HIGH
+
+@feature
+def elbow_at_start_angle(frame):
+    """Elbow at ~90°."""
+    angle = frame["left_elbow_angle"]
+    return (START_ANGLE_LOW <= angle) & (angle <= START_ANGLE_HIGH)
+
+# 3-state Shoulder Press:
+#   - State 0 => Elbows at ~90° (below nose)
+#   - State 1 => Overhead (elbow crosses nose => elbow.y < nose.y)
+#   - State 2 => Returning to ~90°
+#   A rep is counted when user returns to ~90° from overhead.
+SHOULDER_PRESS = ExerciseDefinition(
+    "Shoulder Press",
+    transitions={
+        0: [("elbow_above_nose", 1)],
+        1: [("not elbow_above_nose", 2)],
+        2: [("elbow_at_start_angle and not elbow_above_nose", 0, REP)],
+    },
+    feedback={
+        0: [("elbow_above_nose", "Great! Elbows overhead. Now bring them down."),
+            ("elbow_under_start_angle", "Extend elbows more (~90°)."),
+            ("elbow_over_start_angle", "Bend elbows more (~90°)."),
+            (None, "Push elbows overhead until they cross your nose.")],
+        1: [("not elbow_above_nose", "Lower elbows to ~90° to finish the rep."),
+            (None, "Hold overhead, then begin lowering.")],
+        2: [("elbow_at_start_angle and not elbow_above_nose", "Rep complete! You're back at the starting position."),
+            (None, "Bring elbows back to ~90° to complete the rep.")],
+    },
+    skip_when="too_clustered",
+)
+
+##############################################################################
+# BICEP CURL (One Hand at a Time, Side View)
+##############################################################################
+
+FLEXION_ANGLE_THRESHOLD = 45  # Angle at peak flexion
+EXTENSION_ANGLE_THRESHOLD = 160  # Angle at full extension
+
+@feature
+def curl_angle(frame):
+    if frame.side in ("left", "right"):
+        return frame[f"{frame.side}_elbow_angle"]
+    return np.zeros(len(frame.landmarks)) if frame.batch else 0  # Invalid side
+
+@feature
+def arm_flexed(frame):
+    return frame["curl_angle"] < FLEXION_ANGLE_THRESHOLD
+
+@feature
+def arm_extended(frame):
+    return frame["curl_angle"] > EXTENSION_ANGLE_THRESHOLD
+
+@feature
+def arm_short_of_extension(frame):
+    return frame["curl_angle"] < EXTENSION_ANGLE_THRESHOLD
+
+# Counts bicep curl reps for a single arm (side view):
+#   - State 0 => full extension
+#   - State 1 => flexed; a rep is counted back at full extension
+BICEP_CURL = ExerciseDefinition(
+    "Bicep Curl",
+    transitions={
+        0: [("arm_flexed", 1)],
+        1: [("arm_extended", 0, REP)],
+    },
+    feedback={
+        0: [("arm_flexed", "Great curl! Now extend your arm fully."),
+            ("arm_short_of_extension", "Extend your arm further to start the rep."),
+            (None, "Curl your {side} arm towards your shoulder.")],
+        1: [("arm_extended", "Rep complete! Start your next curl."),
+            (None, "Extend your arm completely to complete the rep.")],
+    },
+    single_arm=True,
+)
+
+##############################################################################
+# 3) SQUATS (Pose Landmarks Only, No Angles, 
+#    Rep counted once user returns fully to original standing position with a 1-second hold)
+##############################################################################
+
+SQUAT_MIN_DISTANCE = 0.2  # Hip-knee vertical distance for "near", and margin for "above"
+
+@feature
+def hip_near_knee(frame):
+    return abs(frame.y(LEFT_HIP) - frame.y(LEFT_KNEE)) <= SQUAT_MIN_DISTANCE
+
+@feature
+def hip_above_knee(frame):
+    """Hips significantly above the knees."""
+    return frame.y(LEFT_HIP) < frame.y(LEFT_KNEE) - SQUAT_MIN_DISTANCE
+
+# 3-state logic for Squats with a hold at the bottom:
+#   - State 0 => Standing (hip significantly above knee)
+#   - State 1 => Squat position (hip near knee level) with hold
+#   - State 2 => Returning to standing
+#   A rep is counted after holding the squat position for HOLD_REQUIRED_SECONDS
+#   and returning to standing. The hold is timed with the frames' capture times.
+SQUATS = ExerciseDefinition(
+    "Squats",
+    transitions={
+        0: [("hip_near_knee and not hold_just_abandoned", 1)],
+        1: [("hip_near_knee and hold_complete", 2),
+            ("not hip_near_knee", 0)],  # Did not hold the squat position long enough
+        2: [("hip_above_knee", 0, REP)],
+    },
+    feedback={
+        0: [("hip_near_knee", "Great squat! Hold this position for {hold_seconds} second(s) to complete the rep."),
+            (None, "Squat down until your hips are close to your knees and hold for {hold_seconds} second(s).")],
+        1: [("hold_started and not hold_complete", "Hold the squat position for {remaining_time:.1f} more second(s)."),
+            ("hold_started", "Hold achieved! Now return to standing to complete the rep."),
+            (None, "Hold the squat position for {hold_seconds} second(s).")],
+        2: [("hip_above_knee", "Rep complete! You're back at the starting position."),
+            (None, "Keep rising until you are fully standing to complete the rep.")],
+    },
+    hold_state=1,
+    uses_dumbbells=False,
+)
+
+EXERCISES = {exercise.name: exercise for exercise in (LATERAL_RAISE, SHOULDER_PRESS, BICEP_CURL, SQUATS)}
+
+##############################################################################
+# HAND HOLDING DETECTION
+##############################################################################
+
+def is_hand_holding_object(hand_landmarks):
+    """
+    Determines if a hand is holding an object based on its (21, 4) landmark array.
+    Returns True if the majority of fingers are curled and the spread of fingertips is small.
+    """
+    # Define finger tip and pip landmarks indices
+    FINGER_TIPS = [4, 8, 12, 16, 20]
+    FINGER_PIPS = [3, 6, 10, 14, 18]
+    
+    # Criterion 1: Majority of fingers are curled
+    # In MediaPipe, higher y-value means lower in the image (assuming origin at top-left)
+    curled_fingers = int(np.count_nonzero(hand_landmarks[FINGER_TIPS, Y] > hand_landmarks[FINGER_PIPS, Y]))
+    
+    # Update: Require at least 4 curled fingers instead of 3
+    REQUIRED_CURLED_FINGERS = 4
+    
+    # Criterion 2: Spread of fingertips is small
+    # Calculate average distance between all pairs of fingertips
+    tips = hand_landmarks[FINGER_TIPS, :2]
+    i, j = np.triu_indices(len(FINGER_TIPS), k=1)
+    avg_distance = float(np.linalg.norm(tips[i] - tips[j], axis=1).mean())
+    
+    # Update: Lower the spread threshold for stricter detection
+    SPREAD_THRESHOLD = 0.15  # Previously 0.2
+    
+    small_spread = avg_distance < SPREAD_THRESHOLD
+    
+    # Logging for debugging
+    logging.debug(f"Curled fingers: {curled_fingers}, Average fingertip distance: {avg_distance:.3f}, Small spread: {small_spread}")
+    
+    # Determine holding status based on updated criteria
+    if curled_fingers >= REQUIRED_CURLED_FINGERS and small_spread:
+        return True
+    else:
+        return False
+
+##############################################################################
+# MAIN EXERCISE ROUTER
+##############################################################################
+
+def evaluate_exercise(landmarks, exercise_type, exercise_state, side=None, timestamp=None):
+    """
+    Advances the state machine for `exercise_type` and returns (rep_count, feedback).
+    `timestamp` is the frame's capture time in seconds (server time when not
+    given) and is the only clock the state machines see, so results don't
+    depend on when the frame reached the server. A frame captured before one
+    already counted is not applied; the current count and feedback are
+    returned for it instead.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    if exercise_state.last_timestamp is not None and timestamp < exercise_state.last_timestamp:
+        logging.debug(f"Frame captured at {timestamp} arrived after {exercise_state.last_timestamp}; not applied.")
+        return exercise_state.rep_count, exercise_state.last_feedback or "Move to start position or select a valid exercise."
+    exercise_state.last_timestamp = timestamp
+
+    exercise = EXERCISES.get(exercise_type)
+    if exercise is not None:
+        rep_count, feedback = exercise.evaluate(landmarks, exercise_state, timestamp, side or "left")
+    else:
+        rep_count, feedback = exercise_state.rep_count, "Move to start position or select a valid exercise."
+    exercise_state.last_feedback = feedback
+    return rep_count, feedback
+
+##############################################################################
+# OFFLINE REP COUNTING (a whole landmark time series at once)
+##############################################################################
+
+def _runs(symbols):
+    """(start, end, symbol) for each run of equal symbols."""
+    if not len(symbols):
+        return []
+    starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+    ends = np.r_[starts[1:], len(symbols)]
+    return zip(starts.tolist(), ends.tolist(), symbols[starts].tolist())
+
+
+def _transition_symbols(exercise, features, frames):
+    """
+    For every frame, the transition each state of `exercise` would take
+    (0 for none, k + 1 for its k-th), packed into one integer with a digit
+    per state, from the batch features.
+    """
+    base = 1 + max(len(rules) for rules in exercise.transitions.values())
+    symbols = np.zeros(frames, dtype=np.int64)
+    for state, rules in exercise.transitions.items():
+        choice = np.zeros(frames, dtype=np.int64)
+        for index in reversed(range(len(rules))):  # The first rule that holds wins
+            choice[rules[index][0].mask(features, frames)] = index + 1
+        symbols += choice * base ** state
+    return symbols, base
+
+
+def _scan_transitions(frames, symbols, base, exercise, state):
+    """
+    Steps the exercise's transitions over the symbols of `frames` (the indexes
+    of the frames that are applied), one run of equal symbols at a time. A run
+    only moves the state until it reaches a state the symbol leaves alone, so
+    a run costs at most a couple of steps however many frames it spans.
+    Returns the final state and the (frame, from_state, to_state, rep_counted)
+    transitions.
+    """
+    transitions = []
+    for start, end, symbol in _runs(symbols[frames]):
+        for position in range(start, end):
+            choice = symbol // base ** state % base
+            if not choice:
+                break
+            _, next_state, counts_rep = exercise.transitions[state][choice - 1]
+            transitions.append((frames[position], state, next_state, counts_rep))
+            state = next_state
+    return state, transitions
+
+
+def _scan_squats(frames, features, timestamps, exercise_state):
+    """
+    The squat table over the applied `frames`, run by run of hip positions.
+    The hold is timed over a whole run of "near" frames with one vectorized
+    comparison of capture times. Updates the hold fields of exercise_state and
+    returns the transitions like _scan_transitions.
+    """
+    near, above = features["hip_near_knee"][frames], features["hip_above_knee"][frames]
+    symbols = np.where(near, 0, np.where(above, 1, 2))
+    state = exercise_state.position_state
+    previous_state = exercise_state.previous_position_state
+    hold_start = exercise_state.squat_hold_start_time
+    times = timestamps[frames]
+    transitions = []
+    for start, end, symbol in _runs(symbols):
+        position = start
+        while position < end:
+            if state == 0 and symbol == 0 and previous_state != 1:
+                hold_start = times[position]
+                transitions.append((frames[position], 0, 1, False))
+                previous_state, state = 0, 1
+                position += 1
+            elif state == 0 and symbol == 0:  # Just dropped out of a hold, can enter next frame
+                previous_state = 0
+                position += 1
+            elif state == 1 and symbol == 0:
+                held = [] if hold_start is None else np.flatnonzero(
+                    times[position:end] - hold_start >= exercise_state.HOLD_REQUIRED_SECONDS
+                )
+                if not len(held):
+                    previous_state = 1
+                    break
+                position += int(held[0])
+                transitions.append((frames[position], 1, 2, False))
+                previous_state, state = 1, 2
+                position += 1
+            elif state == 1:  # Hold not achieved
+                transitions.append((frames[position], 1, 0, False))
+                previous_state, state, hold_start = 1, 0, None
+                position += 1
+            elif state == 2 and symbol == 1:
+                transitions.append((frames[position], 2, 0, True))
+                previous_state, state, hold_start = 2, 0, None
+                position += 1
+            else:  # Nothing changes for the rest of the run
+                previous_state = state
+                break
+    exercise_state.previous_position_state = previous_state
+    exercise_state.squat_hold_start_time = hold_start
+    return state, transitions
+
+
+def count_reps_offline(landmarks, timestamps, exercise_type, side="left", exercise_state=None):
+    """
+    Batch counterpart of evaluate_exercise for a whole recording. Takes a
+    (T, 33, 4) landmark array (NaN rows for frames without a pose, which the
+    live path never evaluates) and the (T,) capture times in seconds, and
+    returns what evaluate_exercise would count calling it on every frame in
+    order: a dict with the final rep_count, `counts` (the rep count after each
+    frame), `rep_frames` (the frame each rep was counted on) and
+    `rep_start_frames` (the frame each rep left the starting position, -1 if
+    before the series). The exercise's features are computed for all frames
+    in one NumPy pass; only the state changes are stepped in Python. Starts
+    from exercise_state when given and leaves it as the live path would,
+    apart from last_feedback.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    exercise_state = exercise_state or ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+
+    # Frames evaluate_exercise would apply: a pose, and not captured before a frame already applied
+    has_pose = ~np.isnan(landmarks).any(axis=(1, 2))
+    previous = -np.inf if exercise_state.last_timestamp is None else exercise_state.last_timestamp
+    latest = np.maximum.accumulate(np.r_[previous, np.where(has_pose, timestamps, -np.inf)])
+    applied = has_pose & (timestamps >= latest[:-1])
+    if applied.any():
+        exercise_state.last_timestamp = float(latest[-1])
+
+    transitions = []
+    rep_start = -1  # Reps already under way when the series starts
+    exercise = EXERCISES.get(exercise_type)
+    if exercise is not None:
+        features = BatchFeatures(landmarks, side or "left")
+        if exercise.skip_when is not None:
+            applied &= ~exercise.skip_when.mask(features, len(landmarks))
+        frames = np.flatnonzero(applied)
+        if exercise.hold_state is not None:
+            state, transitions = _scan_squats(frames, features, timestamps, exercise_state)
+        else:
+            symbols, base = _transition_symbols(exercise, features, len(landmarks))
+            state, transitions = _scan_transitions(frames.tolist(), symbols, base, exercise, exercise_state.position_state)
+        exercise_state.position_state = state
+
+    rep_frames, rep_start_frames = [], []
+    for frame, from_state, to_state, rep_counted in transitions:
+        if from_state == 0:
+            rep_start = int(frame)
+        if rep_counted:
+            rep_frames.append(int(frame))
+            rep_start_frames.append(rep_start)
+    counts = exercise_state.rep_count + np.bincount(
+        np.array(rep_frames, dtype=np.int64), minlength=len(landmarks)
+    ).cumsum()
+    exercise_state.rep_count += len(rep_frames)
+    return {
+        "rep_count": exercise_state.rep_count,
+        "counts": counts,
+        "rep_frames": np.array(rep_frames, dtype=np.int64),
+        "rep_start_frames": np.array(rep_start_frames, dtype=np.int64),
+    }
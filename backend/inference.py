@@ -0,0 +1,486 @@
+import os
+import logging
+import threading
+import itertools
+import queue
+import atexit
+import zlib
+import multiprocessing
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+import mediapipe as mp
+from metrics import metrics
+
+##############################################################################
+# MEDIAPIPE POSE AND HANDS INITIALIZATION
+##############################################################################
+
+mp_pose = mp.solutions.pose
+mp_hands = mp.solutions.hands
+
+# Number of Pose and Hands graphs kept warm per worker process
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", os.cpu_count() or 1))
+# Dedicated inference processes; 0 keeps inference on the request threads
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", 0))
+INFERENCE_SLOTS = int(os.getenv("INFERENCE_SLOTS", 4))  # Shared-memory frame slots per process
+INFERENCE_MAX_FRAME_BYTES = int(os.getenv("INFERENCE_MAX_FRAME_BYTES", 1920 * 1080 * 3))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", 10))
+# Look for hands only in crops around the pose wrists (1 = on). Off by default:
+# one graph per crop measured no faster than one full-frame pass
+HAND_ROI = os.getenv("HAND_ROI", "0") == "1"
+HAND_ROI_MIN_VISIBILITY = float(os.getenv("HAND_ROI_MIN_VISIBILITY", 0.5))
+
+
+def create_pose_graph():
+    return mp_pose.Pose(
+        static_image_mode=False,
+        model_complexity=0,
+        smooth_landmarks=True,
+        enable_segmentation=False,
+        min_detection_confidence=0.1,
+        min_tracking_confidence=0.1,
+    )
+
+
+def create_hands_graph(max_num_hands=2):
+    return mp_hands.Hands(
+        static_image_mode=False,
+        max_num_hands=max_num_hands,
+        model_complexity=0,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+
+def create_hand_roi_graph():
+    # One hand per wrist crop; the crop follows the wrist, so tracking still works
+    return create_hands_graph(max_num_hands=1)
+
+##############################################################################
+# GRAPH POOL (checkout/return with per-session affinity)
+##############################################################################
+
+
+class GraphPool:
+    """
+    Bounded pool of pre-initialized MediaPipe graphs.
+    A graph is only ever used by one thread at a time. Since the graphs run with
+    static_image_mode=False, a session is handed back the graph that last
+    processed one of its frames whenever that graph is idle, so landmark tracking
+    continues from the previous frame instead of starting from a fresh detection.
+    A graph handed to a different session is reset first, so it never tracks or
+    smooths one trainee's landmarks from another trainee's frames (counted
+    in metrics as "graph_resets").
+    """
+
+    def __init__(self, factory, size, name="graph"):
+        self.name = name
+        self._graphs = [factory() for _ in range(size)]
+        self._idle = list(range(size))  # Least recently returned first
+        self._last_session = [None] * size
+        self._cond = threading.Condition()
+        logging.info(f"Initialized {size} MediaPipe {name} graph(s).")
+
+    @contextmanager
+    def checkout(self, session_id=None):
+        with self._cond:
+            while not self._idle:
+                self._cond.wait()
+            index = self._pick(session_id)
+            self._idle.remove(index)
+            previous_session = self._last_session[index]
+        if previous_session is not None and previous_session != session_id:
+            self._graphs[index].reset()
+            metrics.increment("graph_resets")
+        try:
+            yield self._graphs[index]
+        finally:
+            with self._cond:
+                self._last_session[index] = session_id
+                self._idle.append(index)
+                self._cond.notify()
+
+    def _pick(self, session_id):
+        # Prefer the graph still holding this session's tracking state,
+        # then one nobody has used yet, then the least recently used one.
+        for index in self._idle:
+            if self._last_session[index] == session_id:
+                return index
+        for index in self._idle:
+            if self._last_session[index] is None:
+                return index
+        return self._idle[0]
+
+    def __len__(self):
+        return len(self._graphs)
+
+##############################################################################
+# LANDMARK ARRAYS
+##############################################################################
+
+# Inference results leave this module as float32 arrays of (x, y, z, visibility)
+# rows: (33, 4) for the pose and (21, 4) per hand.
+def landmarks_to_array(landmark_list):
+    return np.array(
+        [(lm.x, lm.y, lm.z, lm.visibility) for lm in landmark_list.landmark],
+        dtype=np.float32,
+    )
+
+
+def pose_to_array(pose_results):
+    if not pose_results.pose_landmarks:
+        return None
+    return landmarks_to_array(pose_results.pose_landmarks)
+
+
+def hands_to_arrays(hands_results):
+    """Returns a list of (label, landmarks) with label "left" or "right"."""
+    if not hands_results.multi_hand_landmarks:
+        return []
+    return [
+        (handedness.classification[0].label.lower(), landmarks_to_array(hand_landmarks))
+        for hand_landmarks, handedness in zip(hands_results.multi_hand_landmarks, hands_results.multi_handedness)
+    ]
+
+##############################################################################
+# POSE-GUIDED HAND REGIONS
+##############################################################################
+
+# Pose landmarks of each hand (wrist, pinky, index, thumb) and its elbow
+POSE_HAND_POINTS = {"left": [15, 17, 19, 21], "right": [16, 18, 20, 22]}
+POSE_ELBOWS = {"left": 13, "right": 14}
+MIRRORED_SIDE = {"left": "right", "right": "left"}
+HAND_ROI_SCALE = 1.6  # Crop side as a multiple of the forearm length
+HAND_ROI_MIN_PIXELS = 48
+
+
+def hand_rois(pose_array, frame_shape):
+    """
+    Returns square pixel boxes (side, x0, y0, x1, y1) around every wrist the
+    pose model saw with at least HAND_ROI_MIN_VISIBILITY, sized from the
+    forearm so the whole hand fits. An empty list means hands should be
+    searched for in the full frame.
+    """
+    if pose_array is None:
+        return []
+    height, width = frame_shape[:2]
+    rois = []
+    for side, points in POSE_HAND_POINTS.items():
+        if pose_array[points[0], 3] < HAND_ROI_MIN_VISIBILITY:
+            continue
+        center_x, center_y = pose_array[points, :2].mean(axis=0) * (width, height)
+        forearm = np.hypot(*((pose_array[points[0], :2] - pose_array[POSE_ELBOWS[side], :2]) * (width, height)))
+        half = max(HAND_ROI_SCALE * forearm, HAND_ROI_MIN_PIXELS) / 2
+        x0, y0 = max(int(center_x - half), 0), max(int(center_y - half), 0)
+        x1, y1 = min(int(center_x + half), width), min(int(center_y + half), height)
+        if x1 - x0 >= HAND_ROI_MIN_PIXELS // 2 and y1 - y0 >= HAND_ROI_MIN_PIXELS // 2:
+            rois.append((side, x0, y0, x1, y1))
+    return rois
+
+
+def hands_in_rois(frame, rois, process_crop):
+    """
+    Runs process_crop(side, crop) on each hand box and maps the detected hand
+    landmarks back to full-frame normalized coordinates. The hand is labelled
+    from the wrist its box was built around, since without the arm in view the
+    Hands model's own handedness guess is unreliable. Labels follow the Hands
+    convention (image assumed mirrored), which is the opposite of the pose
+    model's, so "side" keeps meaning what it did with full-frame detection.
+    """
+    height, width = frame.shape[:2]
+    hands = []
+    for side, x0, y0, x1, y1 in rois:
+        crop = np.ascontiguousarray(frame[y0:y1, x0:x1])
+        for _, array in hands_to_arrays(process_crop(side, crop)):
+            array[:, 0] = (x0 + array[:, 0] * (x1 - x0)) / width
+            array[:, 1] = (y0 + array[:, 1] * (y1 - y0)) / height
+            array[:, 2] *= (x1 - x0) / width  # z shares the x scale
+            hands.append((MIRRORED_SIDE[side], array))
+    return hands
+
+##############################################################################
+# FRAME JOBS (each model runs at most once per frame)
+##############################################################################
+
+_NOT_RUN = object()
+
+
+class FrameJob:
+    """
+    Inference for one frame. pose() and hands() run their model on first call
+    and hand back the cached result afterwards, so the serializer, the holding
+    checks and side selection all share one hands inference. Every model run
+    is counted in metrics ("frames_inferred", "pose_inferences",
+    "hands_inferences"); hands_inferences above frames_inferred means something
+    is running the model twice on a frame again.
+    With HAND_ROI on, when the pose has been run and shows a wrist clearly,
+    hands are only searched for in crops around the wrists
+    ("hands_roi_frames"), otherwise in the full frame ("hands_full_frames").
+    """
+
+    def __init__(self, frame_shape):
+        self._frame_shape = frame_shape
+        self._pose = _NOT_RUN
+        self._hands = _NOT_RUN
+        metrics.increment("frames_inferred")
+
+    def pose(self):
+        if self._pose is _NOT_RUN:
+            self._pose = self._run_pose()
+            metrics.increment("pose_inferences")
+        return self._pose
+
+    def peek(self):
+        """Returns (pose, hands) as computed so far, None for a model that hasn't run."""
+        return (
+            None if self._pose is _NOT_RUN else self._pose,
+            None if self._hands is _NOT_RUN else self._hands,
+        )
+
+    def hands(self):
+        if self._hands is _NOT_RUN:
+            rois = []
+            if HAND_ROI and self._pose is not _NOT_RUN:
+                rois = hand_rois(self._pose, self._frame_shape)
+            if rois:
+                self._hands = self._run_hand_rois(rois)
+                metrics.increment("hands_roi_frames")
+            else:
+                self._hands = self._run_hands()
+                metrics.increment("hands_full_frames")
+            metrics.increment("hands_inferences")
+        return self._hands
+
+##############################################################################
+# IN-THREAD INFERENCE
+##############################################################################
+
+
+class ThreadInference:
+    """Runs inference on the calling thread with graphs from per-model GraphPools."""
+
+    def __init__(self, size=INFERENCE_THREADS):
+        self.pose_pool = GraphPool(create_pose_graph, size, name="pose")
+        self.hands_pool = GraphPool(create_hands_graph, size, name="hands")
+        self.hand_roi_pool = GraphPool(create_hand_roi_graph, 2 * size, name="hand ROI") if HAND_ROI else None
+
+    @contextmanager
+    def frame(self, session_id, frame_rgb):
+        yield _ThreadFrameJob(self, session_id, frame_rgb)
+
+
+class _ThreadFrameJob(FrameJob):
+    def __init__(self, backend, session_id, frame_rgb):
+        super().__init__(frame_rgb.shape)
+        self._backend = backend
+        self._session_id = session_id
+        self._frame = frame_rgb
+
+    def _run_pose(self):
+        with self._backend.pose_pool.checkout(self._session_id) as pose:
+            return pose_to_array(pose.process(self._frame))
+
+    def _run_hands(self):
+        with self._backend.hands_pool.checkout(self._session_id) as hands:
+            return hands_to_arrays(hands.process(self._frame))
+
+    def _run_hand_rois(self, rois):
+        return hands_in_rois(self._frame, rois, self._process_crop)
+
+    def _process_crop(self, side, crop):
+        # Each of the session's wrists keeps its own graph, so both stay tracked
+        with self._backend.hand_roi_pool.checkout((self._session_id, side)) as hands:
+            return hands.process(crop)
+
+##############################################################################
+# PROCESS-POOL INFERENCE (shared-memory frame handoff)
+##############################################################################
+
+
+def _inference_worker(shm_name, slot_bytes, requests, results):
+    """
+    Entry point of an inference process. Frames are read in place from the
+    shared-memory slot named in each request; only the small landmark arrays
+    travel back through the results queue. Several sessions share the
+    process's graphs, so a graph is reset before it sees a frame from a
+    different session than its last one.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    graphs = {"pose": create_pose_graph(), "hands": create_hands_graph()}
+    last_session = {}
+
+    def graph_for(key, session_id):
+        if key not in graphs:
+            graphs[key] = create_hand_roi_graph()  # One graph per wrist, created on first use
+        elif last_session.get(key, session_id) != session_id:
+            graphs[key].reset()
+        last_session[key] = session_id
+        return graphs[key]
+
+    try:
+        while True:
+            job = requests.get()
+            if job is None:
+                break
+            job_id, op, slot, shape, rois, session_id = job
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            try:
+                if op == "pose":
+                    output = pose_to_array(graph_for("pose", session_id).process(frame))
+                elif op == "hand_rois":
+                    output = hands_in_rois(frame, rois, lambda side, crop: graph_for(side, session_id).process(crop))
+                else:
+                    output = hands_to_arrays(graph_for("hands", session_id).process(frame))
+                results.put((job_id, output, None))
+            except Exception as e:
+                results.put((job_id, None, f"{op} inference failed: {e}"))
+            del frame  # Release the view before the segment can be closed
+    finally:
+        shm.close()
+
+
+class ProcessInference:
+    """
+    Pool of inference processes, each owning one Pose and one Hands graph.
+    Every process has a shared-memory segment split into fixed-size frame
+    slots (a ring of INFERENCE_SLOTS per process). The request thread copies
+    the decoded frame into a free slot, sends a tiny job tuple and waits on a
+    Future that is completed by the result collector thread. Sessions always
+    go to the same process, and its graphs are reset whenever they switch
+    from one session's frames to another's.
+    """
+
+    def __init__(self, processes=INFERENCE_PROCESSES, slots=INFERENCE_SLOTS, slot_bytes=INFERENCE_MAX_FRAME_BYTES):
+        context = multiprocessing.get_context("spawn")  # Never fork a process running MediaPipe threads
+        self.slot_bytes = slot_bytes
+        self._results = context.Queue()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._workers = []
+        for _ in range(processes):
+            shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+            requests = context.Queue()
+            free_slots = queue.Queue()
+            for slot in range(slots):
+                free_slots.put(slot)
+            process = context.Process(
+                target=_inference_worker,
+                args=(shm.name, slot_bytes, requests, self._results),
+                daemon=True,
+            )
+            process.start()
+            self._workers.append((process, shm, requests, free_slots))
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+        atexit.register(self.close)
+        logging.info(f"Started {processes} inference process(es) with {slots} frame slot(s) each.")
+
+    @contextmanager
+    def frame(self, session_id, frame_rgb):
+        if frame_rgb.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {frame_rgb.nbytes} bytes exceeds the {self.slot_bytes} byte inference slot.")
+        worker = self._workers[zlib.crc32(str(session_id).encode()) % len(self._workers)]
+        _, shm, requests, free_slots = worker
+        slot = free_slots.get(timeout=INFERENCE_TIMEOUT_SECONDS)
+        try:
+            view = np.ndarray(frame_rgb.shape, dtype=np.uint8, buffer=shm.buf, offset=slot * self.slot_bytes)
+            np.copyto(view, frame_rgb)
+            del view
+            yield _ProcessFrameJob(self, requests, slot, frame_rgb.shape, session_id)
+        finally:
+            free_slots.put(slot)
+
+    def _submit(self, requests, op, slot, shape, session_id, rois=None):
+        job_id = next(self._job_ids)
+        future = Future()
+        with self._pending_lock:
+            self._pending[job_id] = future
+        requests.put((job_id, op, slot, shape, rois, session_id))
+        try:
+            return future.result(timeout=INFERENCE_TIMEOUT_SECONDS)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(job_id, None)
+
+    def _collect_results(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            job_id, output, error = message
+            with self._pending_lock:
+                future = self._pending.pop(job_id, None)
+            if future is None:
+                continue  # The request already timed out
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(output)
+
+    def close(self):
+        for process, shm, requests, _ in self._workers:
+            requests.put(None)
+            process.join(timeout=5)
+            shm.close()
+            shm.unlink()
+        self._workers = []
+        self._results.put(None)
+
+
+class _ProcessFrameJob(FrameJob):
+    def __init__(self, backend, requests, slot, shape, session_id):
+        super().__init__(shape)
+        self._backend = backend
+        self._requests = requests
+        self._slot = slot
+        self._shape = shape
+        self._session_id = session_id
+
+    def _run_pose(self):
+        return self._backend._submit(self._requests, "pose", self._slot, self._shape, self._session_id)
+
+    def _run_hands(self):
+        return self._backend._submit(self._requests, "hands", self._slot, self._shape, self._session_id)
+
+    def _run_hand_rois(self, rois):
+        return self._backend._submit(self._requests, "hand_rois", self._slot, self._shape, self._session_id, rois)
+
+
+class PrecomputedFrameJob:
+    """
+    Frame job for clients that run pose estimation themselves: pose() and
+    hands() return the landmark arrays they uploaded instead of running a model.
+    """
+
+    def __init__(self, pose_array, hands=()):
+        self._pose = pose_array
+        self._hands = list(hands)
+
+    def pose(self):
+        return self._pose
+
+    def hands(self):
+        return self._hands
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_inference_backend():
+    """
+    Creates the inference backend on first use rather than at import, so that
+    spawned inference processes (which re-import the main module) and the
+    debug reloader don't build graphs or start processes of their own.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if INFERENCE_PROCESSES > 0:
+                _backend = ProcessInference()
+            else:
+                _backend = ThreadInference()
+        return _backend
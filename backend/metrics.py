@@ -0,0 +1,33 @@
+import threading
+from collections import Counter
+
+##############################################################################
+# SERVER METRICS (process-wide counters, served by /metrics)
+##############################################################################
+
+
+class Metrics:
+    """Thread-safe named counters. Counters appear the first time they are incremented."""
+
+    def __init__(self):
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name):
+        with self._lock:
+            return self._counters[name]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import glob
+import time
+import logging
+import argparse
+import numpy as np
+from inference import PrecomputedFrameJob
+from exercises import ExerciseState, HOLD_REQUIRED_SECONDS, count_reps_offline
+from analysis import analyze_frame
+
+##############################################################################
+# LANDMARK TRACES (opt-in per-session recording)
+##############################################################################
+
+# Directory that session traces are written to; empty (the default) records nothing
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_CHUNK_FRAMES = int(os.getenv("TRACE_CHUNK_FRAMES", 900))  # Frames per .npz chunk (30 s at 30 fps)
+POSE_SHAPE = (33, 4)
+
+
+class TraceRecorder:
+    """
+    Records what the exercise logic saw for one session: every frame's pose
+    landmarks (NaN when no pose was found), exercise type, side and capture
+    timestamp, with the rep count and feedback that were sent back, and where
+    the session was reset. Frames are buffered and written as a compressed
+    .npz chunk every chunk_frames frames (and on close) to
+    <directory>/<start time>-<session id>/chunk-NNNNN.npz, so a trace can be
+    read back even if the server stops mid-session. The caller serializes
+    calls (the session lock).
+    """
+
+    def __init__(self, session_id, directory=TRACE_DIR, chunk_frames=TRACE_CHUNK_FRAMES):
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:64]
+        self.path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_id}")
+        self.chunk_frames = chunk_frames
+        self.chunks_written = 0
+        self.pose = np.empty((chunk_frames, *POSE_SHAPE), dtype=np.float32)
+        self.timestamp = np.empty(chunk_frames, dtype=np.float64)
+        self.rep_count = np.empty(chunk_frames, dtype=np.int32)
+        self.resets = np.zeros(chunk_frames, dtype=bool)
+        self.exercise_type, self.side, self.feedback = [], [], []
+        self.reset_pending = False
+
+    def __len__(self):
+        return len(self.feedback)
+
+    def record(self, result, exercise_type, side, timestamp):
+        index = len(self)
+        pose = result["pose_landmarks"]
+        self.pose[index] = np.nan if pose is None else pose
+        self.timestamp[index] = timestamp
+        self.rep_count[index] = result["rep_count"]
+        self.resets[index] = self.reset_pending
+        self.reset_pending = False
+        self.exercise_type.append(exercise_type)
+        self.side.append(side)
+        self.feedback.append(result["feedback"])
+        if len(self) == self.chunk_frames:
+            self.flush()
+
+    def mark_reset(self):
+        """The session state was reset; the next frame recorded starts from a fresh state."""
+        self.reset_pending = True
+
+    def flush(self):
+        frames = len(self)
+        if not frames:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        chunk_path = os.path.join(self.path, f"chunk-{self.chunks_written:05d}.npz")
+        with open(chunk_path + ".tmp", "wb") as chunk_file:  # Readers never see half a chunk
+            np.savez_compressed(
+                chunk_file,
+                pose=self.pose[:frames],
+                timestamp=self.timestamp[:frames],
+                rep_count=self.rep_count[:frames],
+                reset=self.resets[:frames],
+                exercise_type=np.array(self.exercise_type),
+                side=np.array(self.side),
+                feedback=np.array(self.feedback),
+            )
+        os.replace(chunk_path + ".tmp", chunk_path)
+        logging.debug(f"Wrote {frames} trace frames to {chunk_path}")
+        self.chunks_written += 1
+        self.resets[:] = False
+        self.exercise_type, self.side, self.feedback = [], [], []
+
+    def close(self):
+        self.flush()
+
+
+def load_trace(path):
+    """Reads a trace directory (or a single chunk file) into one dict of per-frame arrays."""
+    chunk_paths = sorted(glob.glob(os.path.join(path, "chunk-*.npz"))) if os.path.isdir(path) else [path]
+    if not chunk_paths:
+        raise ValueError(f"No trace chunks in {path}")
+    chunks = []
+    for chunk_path in chunk_paths:
+        with np.load(chunk_path) as chunk:
+            chunks.append({key: chunk[key] for key in chunk.files})
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+##############################################################################
+# REPLAY
+##############################################################################
+
+def trace_segments(trace):
+    """
+    Splits a trace into (start, end, exercise_type, side, reset) runs of frames
+    with the same exercise type and side; reset is True when the session was
+    reset just before the run.
+    """
+    frames = len(trace["timestamp"])
+    changes = np.flatnonzero(
+        (trace["exercise_type"][1:] != trace["exercise_type"][:-1])
+        | (trace["side"][1:] != trace["side"][:-1])
+        | trace["reset"][1:]
+    ) + 1
+    bounds = [0, *changes.tolist(), frames]
+    return [
+        (start, end, str(trace["exercise_type"][start]), str(trace["side"][start]), bool(trace["reset"][start]))
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def replay_trace(trace, offline=False, max_mismatches=20):
+    """
+    Feeds a recorded trace back through the exercise logic and compares the
+    rep count (and feedback) of every frame with what the session reported.
+    By default each frame goes through analyze_frame, like a /process_landmarks
+    frame, which reproduces both; offline=True counts each segment with
+    count_reps_offline instead, which compares rep counts only but is much
+    faster. Returns a report with the mismatches found.
+    """
+    started = time.perf_counter()
+    exercise_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+    rep_counts = np.empty(len(trace["timestamp"]), dtype=np.int64)
+    feedback = []
+    for start, end, exercise_type, side, reset in trace_segments(trace):
+        if reset:
+            exercise_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+        if offline:
+            counted = count_reps_offline(
+                trace["pose"][start:end], trace["timestamp"][start:end], exercise_type, side, exercise_state
+            )
+            rep_counts[start:end] = counted["counts"]
+            continue
+        for index in range(start, end):
+            pose = trace["pose"][index]
+            job = PrecomputedFrameJob(None if np.isnan(pose).any() else pose)
+            result = analyze_frame(job, exercise_state, exercise_type, side, timestamp=float(trace["timestamp"][index]))
+            rep_counts[index] = result["rep_count"]
+            feedback.append(result["feedback"])
+    elapsed = time.perf_counter() - started
+
+    different = rep_counts != trace["rep_count"]
+    if not offline:
+        different |= np.array(feedback) != trace["feedback"]
+    mismatches = [
+        {
+            "frame": int(index),
+            "exercise_type": str(trace["exercise_type"][index]),
+            "recorded": [int(trace["rep_count"][index]), str(trace["feedback"][index])],
+            "replayed": [int(rep_counts[index]), None if offline else feedback[index]],
+        }
+        for index in np.flatnonzero(different)[:max_mismatches]
+    ]
+    frames = len(rep_counts)
+    return {
+        "frames": frames,
+        "rep_count": int(rep_counts[-1]) if frames else 0,
+        "recorded_rep_count": int(trace["rep_count"][-1]) if frames else 0,
+        "mismatched_frames": int(different.sum()),
+        "mismatches": mismatches,
+        "elapsed_seconds": round(elapsed, 4),
+        "frames_per_second": round(frames / elapsed, 1) if elapsed else 0.0,
+    }
+
+##############################################################################
+# COMMAND LINE
+##############################################################################
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded landmark traces through the rep counters and report any differences."
+    )
+    parser.add_argument("traces", nargs="+", help="Trace directories (or single chunk files)")
+    parser.add_argument("--offline", action="store_true", help="Count reps with the batch counter (counts only)")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay each trace this many times, for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)  # Every counted rep is logged at INFO
+    failed = False
+    for path in args.traces:
+        trace = load_trace(path)
+        for _ in range(args.repeat):
+            report = replay_trace(trace, offline=args.offline)
+        print(json.dumps({"trace": path, **report}, indent=2))
+        failed = failed or report["mismatched_frames"] > 0
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
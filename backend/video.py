@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import logging
+import atexit
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from inference import (
+    ThreadInference, PrecomputedFrameJob, create_pose_graph, create_hands_graph, pose_to_array, hands_to_arrays,
+)
+from exercises import EXERCISES, ExerciseState, HOLD_REQUIRED_SECONDS
+from analysis import HandsSchedule, HANDS_EVERY_N_FRAMES, analyze_frame
+
+##############################################################################
+# WHOLE-VIDEO ANALYSIS (streaming decode)
+##############################################################################
+
+DEFAULT_VIDEO_FPS = 30.0  # Used when the container doesn't report a frame rate
+# Frames with a larger short side are scaled down before inference; the pose
+# model works on 256x256 anyway. 0 keeps the original size.
+VIDEO_MAX_SHORT_SIDE = int(os.getenv("VIDEO_MAX_SHORT_SIDE", 720))
+# Processes used for chunked analysis; 1 (the default) analyzes videos frame by
+# frame, which is the only way to get exactly the live pipeline's landmarks
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", 1))
+VIDEO_CHUNK_SECONDS = float(os.getenv("VIDEO_CHUNK_SECONDS", 30.0))
+# Seconds before each chunk that are run only to let pose tracking settle
+VIDEO_CHUNK_OVERLAP_SECONDS = float(os.getenv("VIDEO_CHUNK_OVERLAP_SECONDS", 2.0))
+
+
+class VideoReader:
+    """
+    Iterates over a video file one decoded frame at a time with cv2.VideoCapture,
+    so memory use doesn't grow with the length of the video. Yields
+    (frame_index, timestamp_seconds, rgb_frame) for every frame_step-th frame
+    in [start, end); the frames in between are only grabbed, never converted.
+    Indexes count from the start of the video, so every reader of the same file
+    picks the same frames. The RGB array is reused from frame to frame.
+    """
+
+    def __init__(self, path, frame_step=1, max_short_side=VIDEO_MAX_SHORT_SIDE, start=0, end=None):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or DEFAULT_VIDEO_FPS
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_step = max(1, int(frame_step))
+        self.max_short_side = max_short_side
+        self.start = start
+        self.end = end
+        self._rgb = None
+
+    def __iter__(self):
+        if self.start:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+        index = self.start - 1
+        try:
+            while (self.end is None or index + 1 < self.end) and self.capture.grab():
+                index += 1
+                if index % self.frame_step:
+                    continue
+                ok, frame = self.capture.retrieve()
+                if not ok:
+                    break
+                yield index, index / self.fps, self._to_rgb(frame)
+        finally:
+            self.capture.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.capture.release()
+
+    def _to_rgb(self, frame):
+        height, width = frame.shape[:2]
+        if self.max_short_side and min(height, width) > self.max_short_side:
+            scale = self.max_short_side / min(height, width)
+            frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = np.empty_like(frame)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+
+class RepTimeline:
+    """Collects per-frame results into the rep timeline and report of a video."""
+
+    def __init__(self):
+        self.entries = []
+        self.feedback = None
+        self.frames = 0
+        self.last_timestamp = 0.0
+
+    def add(self, index, timestamp, result):
+        self.frames += 1
+        self.feedback = result["feedback"]
+        self.last_timestamp = timestamp
+        previous_rep = self.entries[-1] if self.entries else None
+        if result["rep_count"] > (previous_rep["rep"] if previous_rep else 0):
+            self.entries.append({
+                "rep": result["rep_count"],
+                "frame": index,
+                "time": round(timestamp, 3),
+                "duration": round(timestamp - (previous_rep["time"] if previous_rep else 0.0), 3),
+                "feedback": self.feedback,
+            })
+
+    def report(self, exercise_type, exercise_state, video_fps, elapsed, **extra):
+        logging.info(f"Analyzed {self.frames} video frames in {elapsed:.1f}s ({self.frames / elapsed if elapsed else 0:.1f} fps).")
+        return {
+            "exercise_type": exercise_type,
+            "rep_count": exercise_state.rep_count,
+            "feedback": self.feedback,
+            "timeline": self.entries,
+            "frames": self.frames,
+            "video_fps": video_fps,
+            "duration_seconds": round(self.last_timestamp, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "frames_per_second": round(self.frames / elapsed, 2) if elapsed else 0.0,
+            **extra,
+        }
+
+
+def analyze_video(path, exercise_type, side="left", frame_step=1, backend=None, session_id="video"):
+    """
+    Runs the live pipeline (pose, scheduled hands, the exercise state machine
+    timed by each frame's position in the video) over a whole video file.
+    Returns the final count and feedback, a timeline with one entry per rep,
+    and the processing throughput.
+    """
+    backend = backend or ThreadInference(size=1)
+    reader = VideoReader(path, frame_step)
+    exercise_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+    hands_schedule = HandsSchedule()
+    timeline = RepTimeline()
+
+    started = time.perf_counter()
+    for index, timestamp, frame_rgb in reader:
+        with backend.frame(session_id, frame_rgb) as job:
+            result = analyze_frame(job, exercise_state, exercise_type, side, hands_schedule, timestamp)
+        timeline.add(index, timestamp, result)
+    return timeline.report(exercise_type, exercise_state, reader.fps, time.perf_counter() - started)
+
+##############################################################################
+# PARALLEL CHUNKED VIDEO ANALYSIS
+##############################################################################
+
+def extract_chunk_landmarks(path, start, end, warmup_start, frame_step, hands_every):
+    """
+    Worker process entry point: runs its own Pose (and Hands) graph over frames
+    [warmup_start, end) of the video and returns (index, timestamp, pose,
+    hands) for the frames in [start, end). The warm-up frames before `start`
+    only let pose tracking settle before the first frame that counts. Hands
+    run on every hands_every-th analyzed frame (never when hands_every is 0);
+    other frames carry hands=None.
+    """
+    reader = VideoReader(path, frame_step, start=warmup_start, end=end)
+    pose_graph = create_pose_graph()
+    hands_graph = create_hands_graph() if hands_every else None
+    frames = []
+    for index, timestamp, frame_rgb in reader:
+        pose = pose_to_array(pose_graph.process(frame_rgb))
+        if index < start:
+            continue
+        hands = None
+        if hands_graph is not None and (index // reader.frame_step) % hands_every == 0:
+            hands = hands_to_arrays(hands_graph.process(frame_rgb))
+        frames.append((index, timestamp, pose, hands))
+    return frames
+
+
+_pools = {}  # Worker count -> process pool, kept for the next video
+_pools_lock = threading.Lock()
+
+
+def get_video_pool(workers):
+    """Returns the pool of `workers` chunk-extraction processes, started on first use."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            context = multiprocessing.get_context("spawn")  # Never fork a process running MediaPipe threads
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            atexit.register(pool.shutdown)
+        return pool
+
+
+def analyze_video_parallel(path, exercise_type, side="left", frame_step=1, workers=VIDEO_WORKERS,
+                           chunk_seconds=VIDEO_CHUNK_SECONDS, overlap_seconds=VIDEO_CHUNK_OVERLAP_SECONDS):
+    """
+    Chunked analysis for long recordings. The video is cut into fixed chunks
+    of chunk_seconds; a pool of worker processes extracts landmarks for each
+    chunk with fresh graphs, after overlap_seconds of warm-up frames before it.
+    The exercise state machine, which is cheap, then replays all frames in
+    order in this process, so its state carries across every seam.
+    The chunks don't depend on the number of workers, and MediaPipe tracking
+    is deterministic per chunk, so the result is the same for any worker
+    count (workers=1 runs the chunks in this process). Against the frame by
+    frame analyze_video, the only difference is tracking restarting at each
+    seam, which can move landmarks slightly for a few frames.
+    """
+    with VideoReader(path) as reader:
+        fps, frame_count = reader.fps, reader.frame_count
+    if frame_count <= 0:  # Length unknown, can't be chunked
+        return analyze_video(path, exercise_type, side, frame_step)
+
+    chunk_length = max(1, int(chunk_seconds * fps))
+    overlap = int(overlap_seconds * fps)
+    exercise = EXERCISES.get(exercise_type)
+    hands_every = HANDS_EVERY_N_FRAMES if exercise is None or exercise.uses_dumbbells or exercise.single_arm else 0
+    chunks = [
+        (path, start, min(start + chunk_length, frame_count), max(0, start - overlap), frame_step, hands_every)
+        for start in range(0, frame_count, chunk_length)
+    ]
+    workers = max(1, int(workers))
+
+    started = time.perf_counter()
+    if workers == 1 or len(chunks) == 1:
+        chunk_frames = [extract_chunk_landmarks(*chunk) for chunk in chunks]
+    else:
+        chunk_frames = list(get_video_pool(workers).map(extract_chunk_landmarks, *zip(*chunks)))
+
+    exercise_state = ExerciseState(hold_required_seconds=HOLD_REQUIRED_SECONDS)
+    timeline = RepTimeline()
+    hands = []
+    for frames in chunk_frames:
+        for index, timestamp, pose, frame_hands in frames:
+            if frame_hands is not None:
+                hands = frame_hands
+            # Hands between runs are the last ones seen, like HandsSchedule's skipped frames
+            result = analyze_frame(PrecomputedFrameJob(pose, hands), exercise_state, exercise_type, side, timestamp=timestamp)
+            timeline.add(index, timestamp, result)
+    return timeline.report(
+        exercise_type, exercise_state, fps, time.perf_counter() - started, workers=min(workers, len(chunks)), chunks=len(chunks)
+    )
+
+##############################################################################
+# COMMAND LINE
+##############################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Count reps in a recorded workout video.")
+    parser.add_argument("video", help="Path to the video file")
+    parser.add_argument("--exercise", default="Lateral Raise", choices=list(EXERCISES))
+    parser.add_argument("--side", default="left", choices=["left", "right"], help="Arm tracked for Bicep Curl")
+    parser.add_argument("--frame-step", type=int, default=1, help="Analyze every Nth frame")
+    parser.add_argument("--workers", type=int, default=VIDEO_WORKERS, help="Processes for chunked analysis (1 = sequential)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.workers > 1:
+        report = analyze_video_parallel(args.video, args.exercise, args.side, args.frame_step, args.workers)
+    else:
+        report = analyze_video(args.video, args.exercise, args.side, args.frame_step)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ import { Header } from "../components/Header"; // Ensure Header is correctly imp
 export function Analyze() {
     // Backend API URL
     const API_BASE_URL = "http://localhost:5000/";
+    // Identifies this trainee to the backend so rep counts aren't shared between users
+    const sessionIdRef = useRef(crypto.randomUUID());
 
     // Exercise Configuration States
     const [selectedExercise, setSelectedExercise] = useState("Lateral Raise");
@@ -160,11 +162,14 @@ export function Analyze() {
         hiddenCanvas.height = 240;
 
         hiddenContext.drawImage(video, 0, 0, hiddenCanvas.width, hiddenCanvas.height);
+        const capturedAt = Date.now(); // Server times squat holds by this, not by arrival
 
         hiddenCanvas.toBlob(async (blob) => {
             const formData = new FormData();
             formData.append("frame", blob, "frame.jpg");
             formData.append("exercise_type", selectedExercise);
+            formData.append("session_id", sessionIdRef.current);
+            formData.append("timestamp", capturedAt);
             if (selectedExercise === "Bicep Curl") {
                 formData.append("side", bicepCurlSide);
             }
@@ -196,7 +201,7 @@ export function Analyze() {
 
                     // Check if we reached the target reps
                     if (data.rep_count >= reps && !isResting) {
-                        await axios.post(`${API_BASE_URL}reset_exercise`);
+                        await axios.post(`${API_BASE_URL}reset_exercise`, { session_id: sessionIdRef.current });
                         setCurrentRepCount(0);
                         startRestTimer();
                         return;
@@ -437,7 +442,7 @@ export function Analyze() {
     // Function to Start or Reset Exercise
     const handleStart = async () => {
         try {
-            await axios.post(`${API_BASE_URL}reset_exercise`);
+            await axios.post(`${API_BASE_URL}reset_exercise`, { session_id: sessionIdRef.current });
             
             setCurrentSetCount(1);
             setCurrentRepCount(0);